@@ -0,0 +1,71 @@
+import time
+import itertools
+import concurrent.futures
+from argparse import ArgumentParser
+from evaluator import likert, rubric
+from utils import cache
+from utils.basic import configure_images
+from utils.rubric_index import load_rubrics
+
+TOKEN_KEYS = ["prompt_token_count", "candidates_token_count", "thoughts_token_count", "cached_token_count"]
+
+
+def parse_args():
+    parser = ArgumentParser(description="Compare --joint_single against two single-mode requests per question.")
+    parser.add_argument("--setting", type=str, default="likert", choices=["likert", "rubric"])
+    parser.add_argument("--with_image", action="store_true")
+    parser.add_argument("--num_questions", type=int, default=20)
+    parser.add_argument("--max_workers", type=int, default=16)
+    parser.add_argument("--data_path", type=str, default="data/all.jsonl")
+    parser.add_argument("--screenshots_dir", type=str, default="data/screenshots")
+    parser.add_argument("--model", type=str, default="gpt-4.1")
+    parser.add_argument("--prefix_cache", action="store_true")
+    parser.add_argument("--rubric_type", type=str, default="combined", choices=["combined", "static", "dynamic", "intention"])
+    parser.add_argument("--rubric_path", type=str, default="data/rubric.jsonl")
+    return parser.parse_args()
+
+
+def run_path(args, joint_single):
+    """Judge the first --num_questions questions in single mode; returns (records, token totals, seconds)."""
+    args.joint_single = joint_single
+    item_mode = "joint" if joint_single else "single"
+    num_items = args.num_questions * (1 if joint_single else 2)
+    if args.setting == "likert":
+        items = list(itertools.islice(likert.iter_items(args), num_items))
+        process = lambda item: likert.process_item(item, item_mode, args.with_image, args.model, args.prefix_cache)
+    else:
+        items = list(itertools.islice(rubric.iter_items(args, load_rubrics(args.rubric_path)), num_items))
+        process = lambda item: rubric.process_item(item, item_mode, args.with_image, args.rubric_type, args.model, args.prefix_cache)
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        outputs = list(executor.map(process, items))
+    elapsed = time.perf_counter() - start
+
+    records = [record for output in outputs for record in (output if joint_single else [output])]
+    totals = {key: sum(record["metadata"].get(key, 0) for record in records if record["metadata"]) for key in TOKEN_KEYS}
+    return records, totals, elapsed
+
+
+def main(args):
+    args.mode = "single"
+    results = {}
+    for name, joint_single in [("two calls", False), ("joint", True)]:
+        records, totals, elapsed = run_path(args, joint_single)
+        results[name] = (totals, elapsed)
+        print(f"{name}: {len(records)} judgments in {elapsed:.1f}s, tokens: {totals}")
+
+    (base_totals, base_time), (joint_totals, joint_time) = results["two calls"], results["joint"]
+    print(f"{'':<24}{'two calls':>12}{'joint':>12}{'ratio':>8}")
+    for key in TOKEN_KEYS:
+        ratio = joint_totals[key] / base_totals[key] if base_totals[key] else float("nan")
+        print(f"{key:<24}{base_totals[key]:>12}{joint_totals[key]:>12}{ratio:>8.2f}")
+    print(f"{'wall clock (s)':<24}{base_time:>12.1f}{joint_time:>12.1f}{joint_time / base_time:>8.2f}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # every request has to reach the API for the timings and token counts to mean anything
+    cache.configure(enabled=False)
+    configure_images()
+    main(args)
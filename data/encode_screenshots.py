@@ -0,0 +1,20 @@
+import sys
+from argparse import ArgumentParser
+sys.path.append(".")
+from utils.basic import precompute_image_store, configure_images
+
+
+def parse_args():
+    parser = ArgumentParser()
+    parser.add_argument("--screenshots_dir", type=str, default="data/screenshots")
+    parser.add_argument("--image_max_size", type=int, default=None)
+    parser.add_argument("--image_format", type=str, default="png", choices=["png", "palette", "jpeg", "webp"])
+    parser.add_argument("--image_quality", type=int, default=85)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    configure_images(max_size=args.image_max_size, image_format=args.image_format, quality=args.image_quality)
+    count = precompute_image_store(args.screenshots_dir)
+    print(f"Encoded {count} screenshots in {args.screenshots_dir}")
@@ -1,6 +1,9 @@
 import json
+import sys
 from datasets import load_dataset
 import pandas as pd
+sys.path.append(".")
+from utils.dataset import build_index
 
 
 if __name__ == "__main__":
@@ -18,5 +21,6 @@ if __name__ == "__main__":
             item = ds[int(i)]
             item["label"] = labels[i]
             f.write(json.dumps(item) + "\n")
+    build_index("data/all.jsonl")
 
-    print("Done preparing data, category saved to data/category.csv, data saved to data/all.jsonl")
\ No newline at end of file
+    print("Done preparing data, category saved to data/category.csv, data saved to data/all.jsonl, index saved to data/all.index.json")
\ No newline at end of file
@@ -4,8 +4,10 @@ from argparse import ArgumentParser
 import sys
 sys.path.append(".")
 from prompts.rubric_generation import RUBRIC_GENERATION_PROMPT
-from utils.get_response import generate
-from utils.basic import extract_and_parse_json
+from utils.get_response import generate_json, agenerate_json, add_usage
+from utils.executor import AsyncExecutor
+from utils import cache
+from utils.rubric_index import load_rubric_index
 from tqdm import tqdm
 
 
@@ -16,27 +18,18 @@ def parse_args():
     parser.add_argument("--rubric_path", type=str, default="data/rubric.jsonl")
     parser.add_argument("--check", action="store_true")
     parser.add_argument("--statistics", action="store_true")
+    parser.add_argument("--use_async", action="store_true")
+    parser.add_argument("--max_concurrency", type=int, default=512)
+    parser.add_argument("--no_cache", action="store_true")
+    parser.add_argument("--cache_path", type=str, default="cache/responses.sqlite")
     return parser.parse_args()
 
 
-def process_rubric(item, model):
-    prompt = [{"role": "user", "content": RUBRIC_GENERATION_PROMPT.replace("[INSERT USER QUERY HERE]", item["user_query"])}]
-    generate_config = {"max_tokens": 16384, "temperature": 0.0}
-    response = None
-    metadata = None
-    rubric = None
-    max_retries = 5
-    for i in range(max_retries):
-        generate_config["temperature"] = 0.0 + 0.1 * i
-        response, metadata = generate(model=model, messages=prompt, generation_config=generate_config)
-        try:
-            rubric = extract_and_parse_json(response)
-            break
-        except Exception as e:
-            if i < max_retries - 1:
-                print(f"Attempt {i+1} failed to parse JSON for item {item.get('question_id', 'unknown')}, retrying...")
-            else:
-                print(f"Item {item.get('question_id', 'unknown')} failed to parse JSON after {max_retries} attempts. Returning last response.")
+def build_prompt(item):
+    return [{"role": "user", "content": RUBRIC_GENERATION_PROMPT.replace("[INSERT USER QUERY HERE]", item["user_query"])}]
+
+
+def rubric_result(item, response, metadata, rubric):
     return {
         "question_id": item["question_id"],
         "model_response": response,
@@ -45,6 +38,14 @@ def process_rubric(item, model):
     }
 
 
+def process_rubric(item, model):
+    return rubric_result(item, *generate_json(model, build_prompt(item), item_id=item.get('question_id', 'unknown')))
+
+
+async def aprocess_rubric(item, model):
+    return rubric_result(item, *await agenerate_json(model, build_prompt(item), item_id=item.get('question_id', 'unknown')))
+
+
 def generate_rubrics(args):
     total_tokens = {
         "prompt_token_count": 0,
@@ -60,8 +61,12 @@ def generate_rubrics(args):
             "user_query": " ".join([i["content"][0]["text"] for i in item["conversation_a"] if i["role"] == "user"])
         })
     results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=64) as executor:
-        future_to_item = {executor.submit(process_rubric, item, args.model): item for item in items}
+    if args.use_async:
+        executor, process_fn = AsyncExecutor(max_concurrency=args.max_concurrency), aprocess_rubric
+    else:
+        executor, process_fn = concurrent.futures.ThreadPoolExecutor(max_workers=64), process_rubric
+    with executor:
+        future_to_item = {executor.submit(process_fn, item, args.model): item for item in items}
         for future in tqdm(concurrent.futures.as_completed(future_to_item), total=len(future_to_item)):
             try:
                 result = future.result()
@@ -71,10 +76,7 @@ def generate_rubrics(args):
                     "rubric_tree": result["rubric"],
                     "model_response": result["model_response"]
                 })
-                metadata = result["metadata"]
-                total_tokens["prompt_token_count"] += metadata["prompt_token_count"]
-                total_tokens["candidates_token_count"] += metadata["candidates_token_count"]
-                total_tokens["thoughts_token_count"] += metadata["thoughts_token_count"]
+                add_usage(total_tokens, result["metadata"])
             except Exception as e:
                 print(f"Error processing item: {e}")
     print(f"Total tokens: {total_tokens}")
@@ -157,56 +159,24 @@ def verify_rubrics(args):
 
 
 def statistics(args):
-    def _compute_height(tree_item):
-        if not isinstance(tree_item, dict) or "children" not in tree_item or tree_item["children"] is None:
-            return 1
-        
-        children = tree_item["children"]
-        if not children:
-            return 1
-        
-        return 1 + max(_compute_height(child) for child in children)
-    
-    def _compute_num_leaves(tree_item):
-        # count '"children": null' in the json string
-        return json.dumps(tree_item, indent=4).count('\"children\": null')
-    
-    height_count = []
-    num_leaves_count = []
-    static_height_count = []
-    intention_height_count = []
-    dynamic_height_count = []
-    static_num_leaves_count = []
-    intention_num_leaves_count = []
-    dynamic_num_leaves_count = []
-
-    with open(args.rubric_path, "r") as f:
-        rubrics = [json.loads(line) for line in f]
-
-    for index, item in enumerate(rubrics):
-        num_leaves = _compute_num_leaves(item['rubric_tree'])
-        num_leaves_count.append(num_leaves)
-        static_height_count.append(_compute_height(item['rubric_tree']['static']))
-        intention_height_count.append(_compute_height(item['rubric_tree']['intention']))
-        dynamic_height_count.append(_compute_height(item['rubric_tree']['dynamic']))
-        height_count.append(1 + max(static_height_count[-1], intention_height_count[-1], dynamic_height_count[-1]))
-        static_num_leaves_count.append(_compute_num_leaves(item['rubric_tree']['static']))
-        intention_num_leaves_count.append(_compute_num_leaves(item['rubric_tree']['intention']))
-        dynamic_num_leaves_count.append(_compute_num_leaves(item['rubric_tree']['dynamic']))
+    rubric_index = list(load_rubric_index(args.rubric_path).values())
+    height_count = [entry["height"] for entry in rubric_index]
+    num_leaves_count = [entry["leaves"] for entry in rubric_index]
 
     print("Average height: ", sum(height_count) / len(height_count))
-    print("Average intention height: ", sum(intention_height_count) / len(intention_height_count))
-    print("Average static height: ", sum(static_height_count) / len(static_height_count))
-    print("Average dynamic height: ", sum(dynamic_height_count) / len(dynamic_height_count))
+    for key in ["intention", "static", "dynamic"]:
+        branch_height_count = [entry["branches"][key]["height"] for entry in rubric_index]
+        print(f"Average {key} height: ", sum(branch_height_count) / len(branch_height_count))
 
     print("Average num leaves: ", sum(num_leaves_count) / len(num_leaves_count))
-    print("Average intention num leaves: ", sum(intention_num_leaves_count) / len(intention_num_leaves_count))
-    print("Average static num leaves: ", sum(static_num_leaves_count) / len(static_num_leaves_count))
-    print("Average dynamic num leaves: ", sum(dynamic_num_leaves_count) / len(dynamic_num_leaves_count))
+    for key in ["intention", "static", "dynamic"]:
+        branch_num_leaves_count = [entry["branches"][key]["leaves"] for entry in rubric_index]
+        print(f"Average {key} num leaves: ", sum(branch_num_leaves_count) / len(branch_num_leaves_count))
 
 
 if __name__ == "__main__":
     args = parse_args()
+    cache.configure(path=args.cache_path, enabled=not args.no_cache)
     if args.statistics:
         statistics(args)
     else:
@@ -8,11 +8,16 @@ from typing import Optional
 from ui_tars.action_parser import parse_action_to_structure_output
 from evaluator.gui_utils import parsing_response_to_pyautogui_code
 from prompts.agent_prompt import PROMPT_CUA_STATIC, PROMPT_CUA_DYNAMIC, PROMPT_CUA_INTENTION
-from utils.basic import encode_image
+from utils.basic import image_to_data_url
 
 
 config = json.load(open("api_keys/config.json"))
 config = config["ui_tars"]
+# one client (and connection pool) per process, shared by the agents of all tasks a worker runs
+ui_tars_client = OpenAI(
+    base_url=config["base_url"],
+    api_key=config["api_key"]
+)
 
 
 def setup_logger(name="UITARS"):
@@ -56,13 +61,12 @@ class UITARS:
         use_thinking: bool = False,
         language: str = "English",
         task_type: str = "static",
+        # OpenAI client, by default the one shared by the process
+        client: Optional[OpenAI] = None,
     ):
         self.model = model
         self.model_type = model_type
-        self.client = OpenAI(
-            base_url=config["base_url"],
-            api_key=config["api_key"]
-        )
+        self.client = client if client is not None else ui_tars_client
 
         self.language = language
 
@@ -107,15 +111,15 @@ class UITARS:
             self.logger.info("="*10 + " Role: user " + "="*10)
             self.logger.info(f"Prompt: {initial_prompt}")
 
-        base64_image = encode_image(image_path)
-        self.observations.append(base64_image)
+        image_url = image_to_data_url(image_path)
+        self.observations.append(image_url)
 
         self.messages.append({
             "role": "user",
             "content": [
                 {
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/png;base64,{base64_image}"}
+                    "image_url": {"url": image_url}
                 }
             ]
         })
@@ -3,6 +3,7 @@ import json
 import re
 from tqdm import tqdm
 import pandas as pd
+from utils.dataset import load_labels
 
 
 def compute_cost(path_list):
@@ -163,9 +164,7 @@ def eval_results(data_path, result_dir, path_list_path, do_check=False):
     with open(path_list_path, "r") as f:
         path_list = [line.strip() for line in f.readlines()]
 
-    with open(data_path, "r") as f:
-        labels = [json.loads(line.strip()) for line in f.readlines()]
-    labels = {item["question_id"]: item["label"] for item in labels}
+    labels = load_labels(data_path)
     if do_check:
         check_result(path_list)
     label_column = []
@@ -2,39 +2,28 @@ import os
 import json
 from tqdm import tqdm
 from prompts.agent_prompt import STATIC_CHECKING_PROMPT, INTENTION_CHECKING_PROMPT
+from utils.dataset import iter_questions, count_records
+from utils.rubric_index import load_rubric_index, load_rubrics, index_rubric, leaf_counts, leaf_descriptions
 
-def static2prompt(rubric, max_lines=10):
+def static2prompt(branch, max_lines=10):
     """
     convert rubric to id based prompt for better processing.
+    branch is the index entry of the static branch (see utils.rubric_index.index_branch).
     If the total lines exceed max_lines, it will be split into multiple prompts.
     The split will try to keep the hierarchy.
     """
-    def traverse(children, prefix="", indent_level=0):
-        lines_with_indent = []
-        if not children:
-            return []
-
-        for i, node in enumerate(children):
-            numbering = f"{prefix}{i + 1}"
-            has_children = node.get("children") and len(node.get("children", [])) > 0
-            
-            indent = "    " * indent_level
-            line = f"{indent}{numbering}"
-            if has_children:
-                line += "."
-            line += f" {node['description']}"
-            lines_with_indent.append((line, indent_level))
-
-            if has_children:
-                lines_with_indent.extend(traverse(node["children"], prefix=f"{numbering}.", indent_level=indent_level + 1))
-        return lines_with_indent
-
-    top_level_nodes = rubric.get("children", [])
-    if not top_level_nodes:
+    if not branch["nodes"]:
         return [""]
 
-    lines_with_indent = traverse(top_level_nodes)
-    
+    lines_with_indent = []
+    for numbering, depth, has_children, description in branch["nodes"]:
+        indent_level = depth - 1
+        line = f"{'    ' * indent_level}{numbering}"
+        if has_children:
+            line += "."
+        line += f" {description}"
+        lines_with_indent.append((line, indent_level))
+
     if len(lines_with_indent) <= max_lines:
         return [STATIC_CHECKING_PROMPT.format(static_elements="\n".join([line for line, indent in lines_with_indent]))]
 
@@ -66,40 +55,22 @@ def static2prompt(rubric, max_lines=10):
     return [STATIC_CHECKING_PROMPT.format(static_elements=prompt) for prompt in prompts]
 
 
-def dynamic2prompt(rubric):
-    """return a list of prompts for each dynamic leaf node"""
-    leaf_descriptions = []
-
-    def find_leaves(node):
-        if node.get("children") is None:
-            if 'description' in node:
-                leaf_descriptions.append(node['description'])
-        else:
-            for child in node.get("children", []):
-                find_leaves(child)
+def dynamic2prompt(branch, part):
+    """return a list of prompts for each dynamic leaf node below node `part` ("1" basic, "2" complex)"""
+    return leaf_descriptions(branch, part)
 
-    find_leaves(rubric)
-    return leaf_descriptions
-
-def intention2prompt(rubric):
+def intention2prompt(branch):
     """return a list of prompts for each intention leaf node"""
-    leaf_descriptions = []
-    def find_leaves(node):
-        if node.get("children") is None:
-            if 'description' in node:
-                leaf_descriptions.append(node['description'])
-        else:
-            for child in node.get("children", []):
-                find_leaves(child)
-    find_leaves(rubric)
-    return [INTENTION_CHECKING_PROMPT.format(intention=intention) for intention in leaf_descriptions]
+    return [INTENTION_CHECKING_PROMPT.format(intention=intention) for intention in leaf_descriptions(branch)]
 
-def process_item(item, rubric, base_dir, add_rubric=True):
+def process_item(item, rubric, base_dir, add_rubric=True, rubric_entry=None):
     """
     Args:
-        item: a dict containing the item information
+        item: a projected record of the dataset (see utils.dataset.project_record)
         rubric: a dict containing the rubric information
         base_dir: a string containing the base directory
+        rubric_entry: the rubric index entry of the question (see utils.rubric_index), for the leaf counts
+            and the task prompts
     Returns:
         None
 
@@ -132,20 +103,20 @@ def process_item(item, rubric, base_dir, add_rubric=True):
                 ... (same structure as a)
     """
     try:
+        if rubric and rubric_entry is None:
+            rubric_entry = index_rubric(rubric)
         metadata = {
             "question_id": item["question_id"],
             "model_a": item["model_a"],
             "model_b": item["model_b"],
-            "query": " ".join([i['content'][0]["text"] for i in item['conversation_a'] if i['role'] == 'user']),
+            "query": item["user_query"],
             "label": item["label"],
             "rubric": rubric,
-            "intention": json.dumps(rubric["intention"], indent=4).count('\"children\": null') if rubric else 0,
-            "static": json.dumps(rubric["static"], indent=4).count('\"children\": null') if rubric else 0,
-            "dynamic": json.dumps(rubric["dynamic"], indent=4).count('\"children\": null') if rubric else 0
+            **(leaf_counts(rubric_entry) if rubric else {"intention": 0, "static": 0, "dynamic": 0})
         }
     except Exception as e:
         print(e)
-        print(item["conversation_a"][0])
+        print(item["question_id"])
         return []
     webs_list = []
     tasks_list = {"a": [], "b": []}
@@ -161,13 +132,13 @@ def process_item(item, rubric, base_dir, add_rubric=True):
         os.makedirs(model_dir, exist_ok=True)
         webs_list.append(model_dir)
         # save code
-        code = item[f"conversation_{model}"][-1]["object"]["code"]
+        code = item[f"code_{model}"]
         with open(os.path.join(model_dir, "index.tsx"), "w") as f:
             f.write(code)
         # intention can directly check, so all in one file is enough
         if add_rubric:
             os.makedirs(os.path.join(model_dir, "intention"), exist_ok=True)
-            intention_parts = intention2prompt(rubric["intention"])
+            intention_parts = intention2prompt(rubric_entry["branches"]["intention"])
             for (i, part) in enumerate(intention_parts):
                 os.makedirs(os.path.join(model_dir, "intention", f"part{i+1}"), exist_ok=True)
                 with open(os.path.join(model_dir, "intention", f"part{i+1}", "metadata.json"), "w") as f:
@@ -175,7 +146,7 @@ def process_item(item, rubric, base_dir, add_rubric=True):
                 tasks_list[model].append(os.path.join(model_dir, "intention", f"part{i+1}"))
             # static
             os.makedirs(os.path.join(model_dir, "static"), exist_ok=True)
-            static_parts = static2prompt(rubric["static"])
+            static_parts = static2prompt(rubric_entry["branches"]["static"])
             for (i, part) in enumerate(static_parts):
                 os.makedirs(os.path.join(model_dir, "static", f"part{i+1}"), exist_ok=True)
                 with open(os.path.join(model_dir, "static", f"part{i+1}", "metadata.json"), "w") as f:
@@ -185,8 +156,8 @@ def process_item(item, rubric, base_dir, add_rubric=True):
             os.makedirs(os.path.join(model_dir, "dynamic"), exist_ok=True)
             os.makedirs(os.path.join(model_dir, "dynamic", "basic"), exist_ok=True)
             os.makedirs(os.path.join(model_dir, "dynamic", "complex"), exist_ok=True)
-            basic_ops = dynamic2prompt(rubric["dynamic"]["children"][0])
-            complex_ops = dynamic2prompt(rubric["dynamic"]["children"][1])
+            basic_ops = dynamic2prompt(rubric_entry["branches"]["dynamic"], "1")
+            complex_ops = dynamic2prompt(rubric_entry["branches"]["dynamic"], "2")
             for (i, op) in enumerate(basic_ops):
                 os.makedirs(os.path.join(model_dir, "dynamic", "basic", f"part{i+1}"), exist_ok=True)
                 with open(os.path.join(model_dir, "dynamic", "basic", f"part{i+1}", "metadata.json"), "w") as f:
@@ -207,17 +178,16 @@ def process_item(item, rubric, base_dir, add_rubric=True):
 def main(args):
     dir_list = []
     os.makedirs(args.base_dir, exist_ok=True)
-    with open(args.data_path, "r") as f:
-        data = [json.loads(line) for line in f]
+    data = iter_questions(args.data_path)
+    total = count_records(args.data_path)
     if args.add_rubric:
-        with open(args.rubric_path, "r") as f:
-            rubric = [json.loads(line) for line in f]
-        rubric = {item["question_id"]: item["rubric_tree"] for item in rubric}
-        for item in tqdm(data):
-            web_list = process_item(item, rubric[item["question_id"]], args.base_dir, args.add_rubric)
+        rubric_index = load_rubric_index(args.rubric_path)
+        rubric = load_rubrics(args.rubric_path, rubric_index)
+        for item in tqdm(data, total=total):
+            web_list = process_item(item, rubric[item["question_id"]], args.base_dir, args.add_rubric, rubric_index.get(item["question_id"]))
             dir_list.extend(web_list)
     else:
-        for item in tqdm(data):
+        for item in tqdm(data, total=total):
             web_list = process_item(item, None, args.base_dir, args.add_rubric)
             dir_list.extend(web_list)
     with open(args.path_list, "w") as f:
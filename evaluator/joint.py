@@ -0,0 +1,56 @@
+import json
+from utils.basic import extract_and_parse_json
+from utils.template import prefix_cache_messages
+
+
+def joint_messages(instructions, content, prefix_cache=False):
+    """Messages of a joint request: the instructions as a prefix message with prefix_cache, else in front of the content."""
+    if prefix_cache:
+        return prefix_cache_messages(instructions, content)
+    if isinstance(content, str):
+        return [{"role": "user", "content": instructions + content}]
+    return [{"role": "user", "content": [{"type": "text", "text": instructions}] + content}]
+
+
+def check_joint_response(response):
+    """Raise unless the response ends with a json object holding one judgment per side."""
+    parsed = extract_and_parse_json(response)
+    if not isinstance(parsed, dict) or "A" not in parsed or "B" not in parsed:
+        raise ValueError("Joint response must have the keys A and B")
+    return parsed
+
+
+def split_joint_result(item, response, metadata, judge):
+    """
+    Single-mode records for both sides of a joint request, each with the judgment of its side as the
+    model_response and judge(parsed judgment of the side, side) as the normalized judgment, so that they
+    are scored exactly like two separate single-mode requests. The full response and the token usage are
+    kept on side a only, so totals are not counted twice.
+    """
+    try:
+        parsed = check_joint_response(response)
+        side_parsed = {side: parsed[side.upper()] for side in ["a", "b"]}
+        side_responses = {side: "```json\n" + json.dumps(side_parsed[side], indent=4) + "\n```" for side in ["a", "b"]}
+    except Exception:
+        side_parsed = {"a": None, "b": None}
+        side_responses = {"a": response, "b": response}
+    results = []
+    for side in ["a", "b"]:
+        if metadata is None:
+            side_metadata = None
+        elif side == "a":
+            side_metadata = {**metadata, "joint": True}
+        else:
+            side_metadata = {key: 0 for key in ["prompt_token_count", "candidates_token_count", "thoughts_token_count", "cached_token_count"]}
+            side_metadata["joint"] = True
+        result = {
+            "question_id": item["question_id"],
+            "model": side,
+            "model_response": side_responses[side],
+            "judgment": judge(side_parsed[side], side),
+            "metadata": side_metadata,
+        }
+        if side == "a":
+            result["joint_response"] = response
+        results.append(result)
+    return results
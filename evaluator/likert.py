@@ -1,237 +1,260 @@
-import json
 import os
 from tqdm import tqdm
 import concurrent.futures
 import pandas as pd
-from utils.get_response import generate
-from utils.basic import encode_image, extract_and_parse_json
+from utils.get_response import generate_json, agenerate_json, add_usage
+from utils.executor import AsyncExecutor, iter_completed
+from utils.dataset import iter_questions, iter_records, count_records, load_labels, load_index
+from utils.jsonl import JsonlWriter, load_finished_keys, unfinished_questions
+from utils.batch import run_batch, batch_custom_id, batch_item
+from utils.basic import image_to_data_url, extract_and_parse_json, try_parse_json
+from utils.template import CompiledTemplate, split_instructions, prefix_cache_messages
+from evaluator.scoring import load_table, parse_likert_results, likert_judgment, normalize_judgment, predict, compute_metrics, sweep
+from evaluator.joint import joint_messages, check_joint_response, split_joint_result
+from prompts.joint_prompt import JOINT_INSTRUCTIONS, JOINT_INPUT
 from prompts.likert_prompt import LIKERT_PROMPT_SINGLE, LIKERT_PROMPT_PAIR, LIKERT_OUTPUT_SINGLE, LIKERT_OUTPUT_PAIR, INPUT_SINGLE, INPUT_PAIR, CODE_ONLY_INPUT_PAIR, CODE_ONLY_INPUT_SINGLE
 
 
-def construct_prompt_single(user_query, code, image=None):
+# templates compiled once, with the input description bound, instead of str.format on every prompt
+SINGLE_TEMPLATE = CompiledTemplate(LIKERT_PROMPT_SINGLE).partial(input_type=INPUT_SINGLE)
+SINGLE_CODE_ONLY_TEMPLATE = CompiledTemplate(LIKERT_PROMPT_SINGLE).partial(input_type=CODE_ONLY_INPUT_SINGLE) + LIKERT_OUTPUT_SINGLE
+PAIR_TEMPLATE = CompiledTemplate(LIKERT_PROMPT_PAIR).partial(input_type=INPUT_PAIR)
+PAIR_CODE_ONLY_TEMPLATE = CompiledTemplate(LIKERT_PROMPT_PAIR).partial(input_type=CODE_ONLY_INPUT_PAIR) + LIKERT_OUTPUT_PAIR
+# --prefix_cache layout: (instructions, per-item prompt, per-item output) by (mode, with_image)
+PREFIX_TEMPLATES = {
+    ("single", True): split_instructions(CompiledTemplate(LIKERT_PROMPT_SINGLE).partial(input_type=INPUT_SINGLE), LIKERT_OUTPUT_SINGLE),
+    ("single", False): split_instructions(CompiledTemplate(LIKERT_PROMPT_SINGLE).partial(input_type=CODE_ONLY_INPUT_SINGLE), LIKERT_OUTPUT_SINGLE),
+    ("pair", True): split_instructions(CompiledTemplate(LIKERT_PROMPT_PAIR).partial(input_type=INPUT_PAIR), LIKERT_OUTPUT_PAIR),
+    ("pair", False): split_instructions(CompiledTemplate(LIKERT_PROMPT_PAIR).partial(input_type=CODE_ONLY_INPUT_PAIR), LIKERT_OUTPUT_PAIR),
+}
+# --joint_single: the single-mode instructions, by with_image, for two solutions judged independently
+JOINT_INSTRUCTIONS_TEXT = {
+    True: split_instructions(CompiledTemplate(LIKERT_PROMPT_SINGLE).partial(input_type=INPUT_PAIR), LIKERT_OUTPUT_SINGLE)[0] + JOINT_INSTRUCTIONS,
+    False: split_instructions(CompiledTemplate(LIKERT_PROMPT_SINGLE).partial(input_type=CODE_ONLY_INPUT_PAIR), LIKERT_OUTPUT_SINGLE)[0] + JOINT_INSTRUCTIONS,
+}
+JOINT_INPUT_TEMPLATE = CompiledTemplate(JOINT_INPUT)
+
+
+def construct_prompt_single(user_query, code, image=None, prefix_cache=False):
+    if prefix_cache:
+        instructions, prompt, _ = PREFIX_TEMPLATES[("single", image is not None)]
+        content = prompt.render(user_query=user_query, code=code)
+        if image is not None:
+            content = [
+                {"type": "text", "text": content},
+                {"type": "text", "text": "\n\n## Initial State\n"},
+                {"type": "image_url", "image_url": {"url": image_to_data_url(image)}},
+            ]
+        return prefix_cache_messages(instructions, content)
     if image is not None:
         content = []
-        content.append({"type": "text", "text": LIKERT_PROMPT_SINGLE.format(input_type=INPUT_SINGLE, user_query=user_query, code=code)})
+        content.append({"type": "text", "text": SINGLE_TEMPLATE.render(user_query=user_query, code=code)})
         content.append({"type": "text", "text": "\n\n## Initial State\n"})
-        content.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{encode_image(image)}"}})
+        content.append({"type": "image_url", "image_url": {"url": image_to_data_url(image)}})
         content.append({"type": "text", "text": LIKERT_OUTPUT_SINGLE})
         return [{"role": "user", "content": content}]
     else:
-        text_content = LIKERT_PROMPT_SINGLE.format(input_type=CODE_ONLY_INPUT_SINGLE, user_query=user_query, code=code) + LIKERT_OUTPUT_SINGLE
+        text_content = SINGLE_CODE_ONLY_TEMPLATE.render(user_query=user_query, code=code)
         return [{"role": "user", "content": text_content}]
 
 
-def construct_prompt_pair(user_query, code_a, code_b, image_a=None, image_b=None):
+def construct_prompt_pair(user_query, code_a, code_b, image_a=None, image_b=None, prefix_cache=False):
+    if prefix_cache:
+        with_image = image_a is not None and image_b is not None
+        instructions, prompt, _ = PREFIX_TEMPLATES[("pair", with_image)]
+        content = prompt.render(user_query=user_query, code_a=code_a, code_b=code_b)
+        if with_image:
+            content = [
+                {"type": "text", "text": content},
+                {"type": "text", "text": "\n\n## Initial State A\n"},
+                {"type": "image_url", "image_url": {"url": image_to_data_url(image_a)}},
+                {"type": "text", "text": "\n\n## Initial State B\n"},
+                {"type": "image_url", "image_url": {"url": image_to_data_url(image_b)}},
+            ]
+        return prefix_cache_messages(instructions, content)
     if image_a is not None and image_b is not None:
         content = []
-        content.append({"type": "text", "text": LIKERT_PROMPT_PAIR.format(input_type=INPUT_PAIR, user_query=user_query, code_a=code_a, code_b=code_b)})
+        content.append({"type": "text", "text": PAIR_TEMPLATE.render(user_query=user_query, code_a=code_a, code_b=code_b)})
         content.append({"type": "text", "text": "\n\n## Initial State A\n"})
-        content.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{encode_image(image_a)}"}})
+        content.append({"type": "image_url", "image_url": {"url": image_to_data_url(image_a)}})
         content.append({"type": "text", "text": "\n\n## Initial State B\n"})
-        content.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{encode_image(image_b)}"}})
+        content.append({"type": "image_url", "image_url": {"url": image_to_data_url(image_b)}})
         content.append({"type": "text", "text": LIKERT_OUTPUT_PAIR})
         return [{"role": "user", "content": content}]
     else:
-        text_content = LIKERT_PROMPT_PAIR.format(input_type=CODE_ONLY_INPUT_PAIR, user_query=user_query, code_a=code_a, code_b=code_b) + LIKERT_OUTPUT_PAIR
+        text_content = PAIR_CODE_ONLY_TEMPLATE.render(user_query=user_query, code_a=code_a, code_b=code_b)
         return [{"role": "user", "content": text_content}]
 
 
-def process_item(item, mode="single", with_image=True, model="gpt-4o"):
-    generate_config = {"max_tokens": 16384, "temperature": 0.0}
-    if mode == "single":
+def construct_prompt_joint(user_query, code_a, code_b, image_a=None, image_b=None, prefix_cache=False):
+    """Both solutions in one request, each judged on its own with the single-mode criteria."""
+    with_image = image_a is not None and image_b is not None
+    content = JOINT_INPUT_TEMPLATE.render(user_query=user_query, code_a=code_a, code_b=code_b)
+    if with_image:
+        content = [
+            {"type": "text", "text": content},
+            {"type": "text", "text": "\n\n## Initial State A\n"},
+            {"type": "image_url", "image_url": {"url": image_to_data_url(image_a)}},
+            {"type": "text", "text": "\n\n## Initial State B\n"},
+            {"type": "image_url", "image_url": {"url": image_to_data_url(image_b)}},
+        ]
+    return joint_messages(JOINT_INSTRUCTIONS_TEXT[with_image], content, prefix_cache)
+
+
+def build_prompt(item, mode="single", with_image=True, prefix_cache=False):
+    if mode == "joint":
         if with_image:
-            prompt = construct_prompt_single(item['user_query'], item['code'], item['image'])
-        else:
-            prompt = construct_prompt_single(item['user_query'], item['code'])
-    else:
+            return construct_prompt_joint(item['user_query'], item['code_a'], item['code_b'], item['image_a'], item['image_b'], prefix_cache)
+        return construct_prompt_joint(item['user_query'], item['code_a'], item['code_b'], prefix_cache=prefix_cache)
+    if mode == "single":
         if with_image:
-            prompt = construct_prompt_pair(item['user_query'], item['code_a'], item['code_b'], item['image_a'], item['image_b'])
-        else:
-            prompt = construct_prompt_pair(item['user_query'], item['code_a'], item['code_b'])
-    
-    response = None
-    metadata = None
-    max_retries = 5
-    for i in range(max_retries):
-        generate_config["temperature"] = 0.0 + 0.1 * i
-        response, metadata = generate(model=model, messages=prompt, generation_config=generate_config)
-        try:
-            extract_and_parse_json(response)
-            break
-        except Exception as e:
-            if i < max_retries - 1:
-                print(f"Attempt {i+1} failed to parse JSON for item {item.get('question_id', 'unknown')}, retrying...")
-            else:
-                print(f"Item {item.get('question_id', 'unknown')} failed to parse JSON after {max_retries} attempts. Returning last response.")
-
-    if mode == "pair":
-        return {
-            "question_id": item['question_id'],
-            "model_response": response,
-            "metadata": metadata,
-        }
-    else:
-        return {
-            "question_id": item['question_id'],
-            "model": item['model'],
-            "model_response": response,
-            "metadata": metadata,
-        }
+            return construct_prompt_single(item['user_query'], item['code'], item['image'], prefix_cache)
+        return construct_prompt_single(item['user_query'], item['code'], prefix_cache=prefix_cache)
+    if with_image:
+        return construct_prompt_pair(item['user_query'], item['code_a'], item['code_b'], item['image_a'], item['image_b'], prefix_cache)
+    return construct_prompt_pair(item['user_query'], item['code_a'], item['code_b'], prefix_cache=prefix_cache)
 
 
-def main(args):
-    total_tokens = {
-        "prompt_token_count": 0,
-        "candidates_token_count": 0,
-        "thoughts_token_count": 0
-    }
-    with open(args.data_path, "r") as f:
-        data = [json.loads(line) for line in f]
-    items = []
-    for item in data:
-        if args.mode == "single":
+def build_result(item, mode, response, metadata):
+    if mode == "joint":
+        return split_joint_result(item, response, metadata,
+                                  lambda parsed, side: normalize_judgment(likert_judgment, parsed, "single", side))
+    result = {"question_id": item['question_id']}
+    if mode != "pair":
+        result["model"] = item['model']
+    result["model_response"] = response
+    # normalized once here, so that evaluation does not parse the raw response again
+    result["judgment"] = normalize_judgment(likert_judgment, try_parse_json(response), mode, item.get('model'))
+    result["metadata"] = metadata
+    return result
+
+
+def process_item(item, mode="single", with_image=True, model="gpt-4o", prefix_cache=False, stream=False):
+    # --stream: stream the completion, record the state of its last json block and request again as soon as a block is malformed
+    response, metadata, _ = generate_json(
+        model, build_prompt(item, mode, with_image, prefix_cache),
+        parse=check_joint_response if mode == "joint" else extract_and_parse_json,
+        item_id=item.get('question_id', 'unknown'), stream=stream,
+    )
+    return build_result(item, mode, response, metadata)
+
+
+async def aprocess_item(item, mode="single", with_image=True, model="gpt-4o", prefix_cache=False, stream=False):
+    response, metadata, _ = await agenerate_json(
+        model, build_prompt(item, mode, with_image, prefix_cache),
+        parse=check_joint_response if mode == "joint" else extract_and_parse_json,
+        item_id=item.get('question_id', 'unknown'), stream=stream,
+    )
+    return build_result(item, mode, response, metadata)
+
+
+def iter_items(args, question_ids=None):
+    for item in iter_questions(args.data_path, question_ids):
+        if args.mode == "single" and not args.joint_single:
             for model in ["a", "b"]:
-                items.append({
+                yield {
                     "question_id": item['question_id'],
                     "model": model,
-                    "user_query": " ".join([i['content'][0]["text"] for i in item['conversation_a'] if i['role'] == 'user']),
-                    "code": item[f"conversation_{model}"][-1]['object']['code'],
+                    "user_query": item['user_query'],
+                    "code": item[f"code_{model}"],
                     "image": os.path.join(args.screenshots_dir, f"{item['question_id']}_{model}.png")
-                })
+                }
         else:
-            items.append({
+            yield {
                 "question_id": item['question_id'],
-                "user_query": " ".join([i['content'][0]["text"] for i in item['conversation_a'] if i['role'] == 'user']),
-                "code_a": item['conversation_a'][-1]['object']['code'],
-                "code_b": item['conversation_b'][-1]['object']['code'],
+                "user_query": item['user_query'],
+                "code_a": item['code_a'],
+                "code_b": item['code_b'],
                 "image_a": os.path.join(args.screenshots_dir, f"{item['question_id']}_a.png"),
                 "image_b": os.path.join(args.screenshots_dir, f"{item['question_id']}_b.png")
-            })
-    print(f"Processing {len(items)} items")
+            }
+
 
-    results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=64) as executor:
-        future_to_item = {executor.submit(process_item, item, args.mode, args.with_image, args.model): item for item in items}
-        for future in tqdm(concurrent.futures.as_completed(future_to_item), total=len(future_to_item)):
+def main(args):
+    total_tokens = {
+        "prompt_token_count": 0,
+        "candidates_token_count": 0,
+        "thoughts_token_count": 0,
+        "cached_token_count": 0
+    }
+    # with --joint_single both sides of a question are judged in one request and written as two single-mode records
+    item_mode = "joint" if args.mode == "single" and args.joint_single else args.mode
+    items = iter_items(args)
+    total = count_records(args.data_path) * (2 if item_mode == "single" else 1)
+    output_path = os.path.join(args.output_dir, f"likert_{args.model}_{args.mode}_{'with_image' if args.with_image else 'no_image'}.jsonl")
+    if args.resume:
+        key_fields = ["question_id", "model"] if args.mode == "single" else ["question_id"]
+        finished = load_finished_keys(output_path, key_fields)
+        # only the questions left to judge are read from the dataset, looked up through its index
+        items = iter_items(args, unfinished_questions(load_index(args.data_path), finished, key_fields))
+        if item_mode == "joint":
+            items = (item for item in items if not {(item["question_id"], "a"), (item["question_id"], "b")} <= finished)
+            total -= len(finished) // 2
+        else:
+            items = (item for item in items if tuple(item[field] for field in key_fields) not in finished)
+            total -= len(finished)
+        print(f"Resuming: {len(finished)} items already finished")
+    print(f"Processing {total} items")
+
+    if args.batch:
+        batch_dir = os.path.join(args.output_dir, "batches", os.path.splitext(os.path.basename(output_path))[0])
+        requests = (
+            (batch_custom_id(item), args.model, build_prompt(item, item_mode, args.with_image, args.prefix_cache), {"max_tokens": 16384, "temperature": 0.0})
+            for item in items
+        )
+        with JsonlWriter(output_path, append=args.resume) as writer:
+            for custom_id, response, metadata in tqdm(run_batch(requests, batch_dir, args.model, args.batch_backend, args.batch_poll_interval)):
+                results = build_result(batch_item(custom_id), item_mode, response, metadata)
+                for result in (results if item_mode == "joint" else [results]):
+                    writer.write(result)
+                add_usage(total_tokens, metadata)
+        print(f"Total tokens: {total_tokens}")
+        return
+
+    if args.use_async:
+        executor, process_fn = AsyncExecutor(max_concurrency=args.max_concurrency), aprocess_item
+        max_pending = 2 * args.max_concurrency
+    else:
+        executor, process_fn = concurrent.futures.ThreadPoolExecutor(max_workers=64), process_item
+        max_pending = 2 * 64
+    with executor, JsonlWriter(output_path, append=args.resume) as writer:
+        completed = iter_completed(executor, process_fn, items, item_mode, args.with_image, args.model, args.prefix_cache, args.stream, max_pending=max_pending)
+        for future in tqdm(completed, total=total):
             try:
-                result = future.result()
-                results.append(result)
-                metadata = result["metadata"]
-                total_tokens["prompt_token_count"] += metadata["prompt_token_count"]
-                total_tokens["candidates_token_count"] += metadata["candidates_token_count"]
-                total_tokens["thoughts_token_count"] += metadata["thoughts_token_count"]
+                results = future.result()
+                for result in (results if item_mode == "joint" else [results]):
+                    writer.write(result)
+                    add_usage(total_tokens, result["metadata"])
             except Exception as e:
                 print(f"Error processing item: {e}")
     print(f"Total tokens: {total_tokens}")
-    with open(os.path.join(args.output_dir, f"likert_{args.model}_{args.mode}_{'with_image' if args.with_image else 'no_image'}.jsonl"), "w") as f:
-        for result in results:
-            f.write(json.dumps(result, ensure_ascii=False) + "\n")
 
 
 def evaluate(args, threshold=1):
     result_path = os.path.join(args.output_dir, f"likert_{args.model}_{args.mode}_{'with_image' if args.with_image else 'no_image'}.jsonl")
-    with open(args.data_path, "r") as f:
-        data = [json.loads(line) for line in f]
-    labels = {item["question_id"]: item["label"] for item in data}
-    with open(result_path, "r") as f:
-        results = [json.loads(line) for line in f]
-    pred = {}
-    error_count = 0
-    if args.mode == "pair":
-        for result in tqdm(results):
-            try:
-                response = result["model_response"]
-                response = extract_and_parse_json(response)
-                score_a = []
-                score_b = []
-                for key, value in response.items():
-                    score_a.append(value["A"])
-                    score_b.append(value["B"])
-                score_a = sum(score_a)
-                score_b = sum(score_b)
-                if score_a > score_b + threshold:
-                    pred[result["question_id"]] = "model_a"
-                elif score_a < score_b - threshold:
-                    pred[result["question_id"]] = "model_b"
-                else:
-                    pred[result["question_id"]] = "tie"
-            except Exception as e:
-                print(f"Error: {e}")
-                pred[result["question_id"]] = "error"
-                error_count += 1
-                continue
-    else:
-        for result in tqdm(results):
-            try:
-                response = result["model_response"]
-                response = extract_and_parse_json(response)
-                score = []
-                for key, value in response.items():
-                    score.append(value)
-                score = sum(score)
-
-                if result["question_id"] in pred:
-                    pred[result["question_id"]][result["model"]] = score
-                else:
-                    pred[result["question_id"]] = {result["model"]: score}
-            except Exception as e:
-                print(f"Error: {e}")
-                pred[result["question_id"]] = "error"
-                error_count += 1
-                continue
-        for key in pred:
-            if pred[key] == "error":
-                continue
-            else:
-                try:
-                    if pred[key]["a"] > pred[key]["b"] + threshold:
-                        pred[key] = "model_a"
-                        
-                    elif pred[key]["a"] < pred[key]["b"] - threshold:
-                        pred[key] = "model_b"
-                    else:
-                        pred[key] = "tie"
-                except KeyError:
-                    print(f"KeyError: {key}")
-                    pred[key] = "error"
-                    error_count += 1
-                    continue
-    acc = 0
-    a_acc = 0
-    a_count = 0
-    b_acc = 0
-    b_count = 0
-    tie_acc = 0
-    tie_count = 0
-    for key in pred:
-        if labels[key] == "model_a":
-            a_count += 1
-        elif labels[key] == "model_b":
-            b_count += 1
-        else:
-            tie_count += 1
-        if pred[key] == labels[key]:
-            acc += 1
-            if pred[key] == "model_a":
-                a_acc += 1
-            elif pred[key] == "model_b":
-                b_acc += 1
-            else:
-                tie_acc += 1
-    print(f"Accuracy: {acc / len(pred)}")
-    balanced_acc = (a_acc / a_count + b_acc / b_count + tie_acc / tie_count) / 3
-
-    label_column = []
-    pred_column = []
-    id_column = []
-    for ques_id in labels:
-        label_column.append(labels[ques_id])
-        pred_column.append(pred[ques_id])
-        id_column.append(ques_id)
-    df = pd.DataFrame({"question_id": id_column, "label": label_column, "pred": pred_column})
+    labels = load_labels(args.data_path)
+    table = load_table(result_path, lambda: parse_likert_results(tqdm(iter_records(result_path)), args.mode))
+    pred = predict(table, table["score"], threshold)
+    metrics = compute_metrics(pred, labels)
+    print(f"Accuracy: {metrics['acc']}")
+
+    df = pd.DataFrame({"question_id": list(labels), "label": list(labels.values()), "pred": pred.reindex(list(labels)).to_numpy()})
     if not os.path.exists("results"):
         os.makedirs("results")
     df.to_csv(f"results/likert_{args.model}_{args.mode}_{'with_image' if args.with_image else 'no_image'}.csv", index=False)
-    return acc, balanced_acc
+    return metrics["correct"], metrics["balanced_acc"]
 
 
+def sweep_thresholds(args, thresholds):
+    """Accuracy and balanced accuracy of evaluate() for every threshold, from a single parse of the outputs."""
+    result_path = os.path.join(args.output_dir, f"likert_{args.model}_{args.mode}_{'with_image' if args.with_image else 'no_image'}.jsonl")
+    labels = load_labels(args.data_path)
+    table = load_table(result_path, lambda: parse_likert_results(tqdm(iter_records(result_path)), args.mode))
+    df = sweep(table, table["score"], labels, thresholds).drop(columns="setting")
+    print(df.to_string(index=False))
+    best = df.loc[df["balanced_acc"].idxmax()]
+    print(f"Best threshold: {best['threshold']}, accuracy: {best['acc']}, balanced accuracy: {best['balanced_acc']}")
+    if not os.path.exists("results"):
+        os.makedirs("results")
+    df.to_csv(f"results/likert_{args.model}_{args.mode}_{'with_image' if args.with_image else 'no_image'}_sweep.csv", index=False)
+    return df
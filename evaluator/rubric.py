@@ -4,8 +4,20 @@ from tqdm import tqdm
 import concurrent.futures
 import pandas as pd
 
-from utils.get_response import generate
-from utils.basic import encode_image, extract_and_parse_json
+from utils.get_response import generate_json, agenerate_json, add_usage
+from utils.executor import AsyncExecutor, iter_completed
+from utils.dataset import iter_questions, iter_records, count_records, load_labels, load_index
+from utils.rubric_index import load_rubric_index, load_rubrics
+from utils.template import CompiledTemplate, split_instructions, prefix_cache_messages
+from utils.jsonl import JsonlWriter, load_finished_keys, unfinished_questions
+from utils.batch import run_batch, batch_custom_id, batch_item
+from utils.basic import image_to_data_url, extract_and_parse_json, try_parse_json
+from evaluator.scoring import (
+    BRANCHES, load_table, parse_rubric_results, rubric_judgment, normalize_judgment,
+    rubric_scores, rubric_score_matrix, predict, compute_metrics, sweep
+)
+from evaluator.joint import joint_messages, check_joint_response, split_joint_result
+from prompts.joint_prompt import JOINT_INSTRUCTIONS, JOINT_INPUT
 from prompts.rubric_prompt import (
     STATIC_PROMPT_SINGLE, STATIC_OUTPUT_SINGLE,
     DYNAMIC_PROMPT_SINGLE, DYNAMIC_OUTPUT_SINGLE,
@@ -19,370 +31,348 @@ from prompts.rubric_prompt import (
 )
 
 
-def construct_prompt_single(user_query, code, rubric, eval_type="combined", image=None):
-    if eval_type == "static":
-        PROMPT, OUTPUT = STATIC_PROMPT_SINGLE, STATIC_OUTPUT_SINGLE
-    elif eval_type == "dynamic":
-        PROMPT, OUTPUT = DYNAMIC_PROMPT_SINGLE, DYNAMIC_OUTPUT_SINGLE
-    elif eval_type == "intention":
-        PROMPT, OUTPUT = INTENT_PROMPT_SINGLE, INTENT_OUTPUT_SINGLE
-    else: # combined
-        PROMPT, OUTPUT = ALL_PROMPT_SINGLE, ALL_OUTPUT_SINGLE
+# templates compiled once, with the input description bound, instead of str.format on every prompt
+TEMPLATES = {
+    mode: {
+        eval_type: {
+            "prompt": CompiledTemplate(PROMPT).partial(input_type=input_type),
+            "code_only_prompt": CompiledTemplate(PROMPT).partial(input_type=code_only_input_type),
+            "output": CompiledTemplate(OUTPUT),
+            # --prefix_cache layout: (instructions, per-item prompt, per-item output)
+            "prefix": split_instructions(CompiledTemplate(PROMPT).partial(input_type=input_type), CompiledTemplate(OUTPUT)),
+            "code_only_prefix": split_instructions(CompiledTemplate(PROMPT).partial(input_type=code_only_input_type), CompiledTemplate(OUTPUT)),
+        }
+        for eval_type, (PROMPT, OUTPUT) in prompts.items()
+    }
+    for mode, input_type, code_only_input_type, prompts in [
+        ("single", INPUT_SINGLE, CODE_ONLY_INPUT_SINGLE, {
+            "static": (STATIC_PROMPT_SINGLE, STATIC_OUTPUT_SINGLE),
+            "dynamic": (DYNAMIC_PROMPT_SINGLE, DYNAMIC_OUTPUT_SINGLE),
+            "intention": (INTENT_PROMPT_SINGLE, INTENT_OUTPUT_SINGLE),
+            "combined": (ALL_PROMPT_SINGLE, ALL_OUTPUT_SINGLE),
+        }),
+        ("pair", INPUT_PAIR, CODE_ONLY_INPUT_PAIR, {
+            "static": (STATIC_PROMPT_PAIR, STATIC_OUTPUT_PAIR),
+            "dynamic": (DYNAMIC_PROMPT_PAIR, DYNAMIC_OUTPUT_PAIR),
+            "intention": (INTENT_PROMPT_PAIR, INTENT_OUTPUT_PAIR),
+            "combined": (ALL_PROMPT_PAIR, ALL_OUTPUT_PAIR),
+        }),
+    ]
+}
+# --joint_single: the single-mode instructions, by (eval_type, with_image), for two solutions judged independently
+JOINT_INSTRUCTIONS_TEXT = {
+    (eval_type, with_image): split_instructions(
+        CompiledTemplate(PROMPT).partial(input_type=INPUT_PAIR if with_image else CODE_ONLY_INPUT_PAIR), CompiledTemplate(OUTPUT)
+    )[0] + JOINT_INSTRUCTIONS
+    for eval_type, (PROMPT, OUTPUT) in {
+        "static": (STATIC_PROMPT_SINGLE, STATIC_OUTPUT_SINGLE),
+        "dynamic": (DYNAMIC_PROMPT_SINGLE, DYNAMIC_OUTPUT_SINGLE),
+        "intention": (INTENT_PROMPT_SINGLE, INTENT_OUTPUT_SINGLE),
+        "combined": (ALL_PROMPT_SINGLE, ALL_OUTPUT_SINGLE),
+    }.items()
+    for with_image in [True, False]
+}
+JOINT_INPUT_TEMPLATE = CompiledTemplate(JOINT_INPUT)
+
+
+def rubric_output(rubric, mode="single", eval_type="combined", prefix_cache=False):
+    """
+    The output instructions with the rubric serialized in (with prefix_cache, only the rubric sections,
+    the instructions go to the prefix); computed once per question and shared by its prompts.
+    """
+    templates = TEMPLATES[mode].get(eval_type, TEMPLATES[mode]["combined"])
+    # the output part is the same with and without images
+    template = templates["prefix"][2] if prefix_cache else templates["output"]
+    if eval_type in ("static", "dynamic", "intention"):
+        return template.render(rubric=json.dumps(rubric[eval_type], indent=4))
+    return template.render(
+        intention_rubric=json.dumps(rubric["intention"], indent=4),
+        static_rubric=json.dumps(rubric["static"], indent=4),
+        dynamic_rubric=json.dumps(rubric["dynamic"], indent=4)
+    )
+
+
+def construct_prompt_single(user_query, code, rubric, eval_type="combined", image=None, rubric_text=None, prefix_cache=False):
+    templates = TEMPLATES["single"].get(eval_type, TEMPLATES["single"]["combined"])
+    if rubric_text is None:
+        rubric_text = rubric_output(rubric, "single", eval_type, prefix_cache)
+
+    if prefix_cache:
+        instructions, prompt, _ = templates["prefix" if image is not None else "code_only_prefix"]
+        if image is not None:
+            content = [
+                {"type": "text", "text": prompt.render(user_query=user_query, code=code)},
+                {"type": "text", "text": "\n\n## Initial State\n"},
+                {"type": "image_url", "image_url": {"url": image_to_data_url(image)}},
+                {"type": "text", "text": rubric_text},
+            ]
+        else:
+            content = prompt.render(user_query=user_query, code=code) + rubric_text
+        return prefix_cache_messages(instructions, content)
 
     if image is not None:
         content = []
-        if eval_type != "combined":
-            text = OUTPUT.format(rubric=json.dumps(rubric[eval_type], indent=4))
-        else:
-            text = OUTPUT.format(
-                intention_rubric=json.dumps(rubric["intention"], indent=4),
-                static_rubric=json.dumps(rubric["static"], indent=4),
-                dynamic_rubric=json.dumps(rubric["dynamic"], indent=4)
-            )
-
-        content.append({"type": "text", "text": PROMPT.format(input_type=INPUT_SINGLE, user_query=user_query, code=code)})
+        content.append({"type": "text", "text": templates["prompt"].render(user_query=user_query, code=code)})
         content.append({"type": "text", "text": "\n\n## Initial State\n"})
-        content.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{encode_image(image)}"}})
-        content.append({"type": "text", "text": text})
+        content.append({"type": "image_url", "image_url": {"url": image_to_data_url(image)}})
+        content.append({"type": "text", "text": rubric_text})
         return [{"role": "user", "content": content}]
     else:
-        if eval_type != "combined":
-            text_content = PROMPT.format(input_type=CODE_ONLY_INPUT_SINGLE, user_query=user_query, code=code) + OUTPUT.format(rubric=json.dumps(rubric[eval_type], indent=4))
-        else:
-            text_content = PROMPT.format(input_type=CODE_ONLY_INPUT_SINGLE, user_query=user_query, code=code) + OUTPUT.format(
-                intention_rubric=json.dumps(rubric["intention"], indent=4),
-                static_rubric=json.dumps(rubric["static"], indent=4),
-                dynamic_rubric=json.dumps(rubric["dynamic"], indent=4)
-            )
+        text_content = templates["code_only_prompt"].render(user_query=user_query, code=code) + rubric_text
         return [{"role": "user", "content": text_content}]
 
-def construct_prompt_pair(user_query, code_a, code_b, rubric, eval_type="combined", image_a=None, image_b=None):
-    if eval_type == "static":
-        PROMPT, OUTPUT = STATIC_PROMPT_PAIR, STATIC_OUTPUT_PAIR
-    elif eval_type == "dynamic":
-        PROMPT, OUTPUT = DYNAMIC_PROMPT_PAIR, DYNAMIC_OUTPUT_PAIR
-    elif eval_type == "intention":
-        PROMPT, OUTPUT = INTENT_PROMPT_PAIR, INTENT_OUTPUT_PAIR
-    else: # combined
-        PROMPT, OUTPUT = ALL_PROMPT_PAIR, ALL_OUTPUT_PAIR
+def construct_prompt_pair(user_query, code_a, code_b, rubric, eval_type="combined", image_a=None, image_b=None, rubric_text=None, prefix_cache=False):
+    templates = TEMPLATES["pair"].get(eval_type, TEMPLATES["pair"]["combined"])
+    if rubric_text is None:
+        rubric_text = rubric_output(rubric, "pair", eval_type, prefix_cache)
+
+    if prefix_cache:
+        with_image = image_a is not None and image_b is not None
+        instructions, prompt, _ = templates["prefix" if with_image else "code_only_prefix"]
+        if with_image:
+            content = [
+                {"type": "text", "text": prompt.render(user_query=user_query, code_a=code_a, code_b=code_b)},
+                {"type": "text", "text": "\n\n## Initial State A\n"},
+                {"type": "image_url", "image_url": {"url": image_to_data_url(image_a)}},
+                {"type": "text", "text": "\n\n## Initial State B\n"},
+                {"type": "image_url", "image_url": {"url": image_to_data_url(image_b)}},
+                {"type": "text", "text": rubric_text},
+            ]
+        else:
+            content = prompt.render(user_query=user_query, code_a=code_a, code_b=code_b) + rubric_text
+        return prefix_cache_messages(instructions, content)
 
     if image_a is not None and image_b is not None:
         content = []
-        if eval_type != "combined":
-            text = OUTPUT.format(rubric=json.dumps(rubric[eval_type], indent=4))
-        else:
-            text = OUTPUT.format(
-                intention_rubric=json.dumps(rubric["intention"], indent=4),
-                static_rubric=json.dumps(rubric["static"], indent=4),
-                dynamic_rubric=json.dumps(rubric["dynamic"], indent=4)
-            )
-        content.append({"type": "text", "text": PROMPT.format(input_type=INPUT_PAIR, user_query=user_query, code_a=code_a, code_b=code_b)})
+        content.append({"type": "text", "text": templates["prompt"].render(user_query=user_query, code_a=code_a, code_b=code_b)})
         content.append({"type": "text", "text": "\n\n## Initial State A\n"})
-        content.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{encode_image(image_a)}"}})
+        content.append({"type": "image_url", "image_url": {"url": image_to_data_url(image_a)}})
         content.append({"type": "text", "text": "\n\n## Initial State B\n"})
-        content.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{encode_image(image_b)}"}})
-        content.append({"type": "text", "text": text})
+        content.append({"type": "image_url", "image_url": {"url": image_to_data_url(image_b)}})
+        content.append({"type": "text", "text": rubric_text})
         return [{"role": "user", "content": content}]
     else:
-        if eval_type != "combined":
-            text_content = PROMPT.format(input_type=CODE_ONLY_INPUT_PAIR, user_query=user_query, code_a=code_a, code_b=code_b) + OUTPUT.format(rubric=json.dumps(rubric[eval_type], indent=4))
-        else:
-            text_content = PROMPT.format(input_type=CODE_ONLY_INPUT_PAIR, user_query=user_query, code_a=code_a, code_b=code_b) + OUTPUT.format(
-                intention_rubric=json.dumps(rubric["intention"], indent=4),
-                static_rubric=json.dumps(rubric["static"], indent=4),
-                dynamic_rubric=json.dumps(rubric["dynamic"], indent=4)
-            )
+        text_content = templates["code_only_prompt"].render(user_query=user_query, code_a=code_a, code_b=code_b) + rubric_text
         return [{"role": "user", "content": text_content}]
 
 
-def process_item(item, mode="single", with_image=True, eval_type="combined", model="gpt-4o"):
+def construct_prompt_joint(user_query, code_a, code_b, rubric, eval_type="combined", image_a=None, image_b=None, rubric_text=None, prefix_cache=False):
+    """Both solutions in one request, each judged on its own against the single-mode rubric."""
+    if eval_type not in ("static", "dynamic", "intention"):
+        eval_type = "combined"
+    if rubric_text is None:
+        rubric_text = rubric_output(rubric, "single", eval_type, prefix_cache=True)
+    with_image = image_a is not None and image_b is not None
+    content = JOINT_INPUT_TEMPLATE.render(user_query=user_query, code_a=code_a, code_b=code_b)
+    if with_image:
+        content = [
+            {"type": "text", "text": content},
+            {"type": "text", "text": "\n\n## Initial State A\n"},
+            {"type": "image_url", "image_url": {"url": image_to_data_url(image_a)}},
+            {"type": "text", "text": "\n\n## Initial State B\n"},
+            {"type": "image_url", "image_url": {"url": image_to_data_url(image_b)}},
+            {"type": "text", "text": rubric_text},
+        ]
+    else:
+        content += rubric_text
+    return joint_messages(JOINT_INSTRUCTIONS_TEXT[(eval_type, with_image)], content, prefix_cache)
+
+
+def build_prompt(item, mode="single", with_image=True, eval_type="combined", prefix_cache=False):
+    rubric_text = item.get('rubric_text')
+    if mode == "joint":
+        if with_image:
+            return construct_prompt_joint(item['user_query'], item['code_a'], item['code_b'], item['rubric'], eval_type, item['image_a'], item['image_b'], rubric_text, prefix_cache)
+        return construct_prompt_joint(item['user_query'], item['code_a'], item['code_b'], item['rubric'], eval_type, rubric_text=rubric_text, prefix_cache=prefix_cache)
     if mode == "single":
         if with_image:
-            prompt = construct_prompt_single(item['user_query'], item['code'], item['rubric'], eval_type, item['image'])
+            return construct_prompt_single(item['user_query'], item['code'], item['rubric'], eval_type, item['image'], rubric_text, prefix_cache)
+        return construct_prompt_single(item['user_query'], item['code'], item['rubric'], eval_type, rubric_text=rubric_text, prefix_cache=prefix_cache)
+    if with_image:
+        return construct_prompt_pair(item['user_query'], item['code_a'], item['code_b'], item['rubric'], eval_type, item['image_a'], item['image_b'], rubric_text, prefix_cache)
+    return construct_prompt_pair(item['user_query'], item['code_a'], item['code_b'], item['rubric'], eval_type, rubric_text=rubric_text, prefix_cache=prefix_cache)
+
+
+def build_result(item, mode, response, metadata, eval_type="combined"):
+    if mode == "joint":
+        return split_joint_result(item, response, metadata,
+                                  lambda parsed, side: normalize_judgment(rubric_judgment, parsed, eval_type))
+    result = {"question_id": item['question_id']}
+    if mode != "pair":
+        result["model"] = item['model']
+    result["model_response"] = response
+    # normalized once here, so that evaluation does not parse the raw response again
+    result["judgment"] = normalize_judgment(rubric_judgment, try_parse_json(response), eval_type)
+    result["metadata"] = metadata
+    return result
+
+
+def process_item(item, mode="single", with_image=True, eval_type="combined", model="gpt-4o", prefix_cache=False, stream=False):
+    # --stream: stream the completion, record the state of its last json block and request again as soon as a block is malformed
+    # the temperature is fixed, so only the first attempt may be served from the cache
+    response, metadata, _ = generate_json(
+        model, build_prompt(item, mode, with_image, eval_type, prefix_cache),
+        parse=check_joint_response if mode == "joint" else extract_and_parse_json,
+        item_id=item.get('question_id', 'unknown'), stream=stream, temperature_step=0,
+    )
+    return build_result(item, mode, response, metadata, eval_type)
+
+
+async def aprocess_item(item, mode="single", with_image=True, eval_type="combined", model="gpt-4o", prefix_cache=False, stream=False):
+    response, metadata, _ = await agenerate_json(
+        model, build_prompt(item, mode, with_image, eval_type, prefix_cache),
+        parse=check_joint_response if mode == "joint" else extract_and_parse_json,
+        item_id=item.get('question_id', 'unknown'), stream=stream, temperature_step=0,
+    )
+    return build_result(item, mode, response, metadata, eval_type)
+
+
+def iter_items(args, rubrics_map, question_ids=None):
+    for item in iter_questions(args.data_path, question_ids):
+        # serialized once per question, and shared by both sides in single mode
+        if args.mode == "single" and args.joint_single:
+            # joint requests carry only the rubric sections, the output instructions are in front
+            rubric_text = rubric_output(rubrics_map[item['question_id']], "single", args.rubric_type, prefix_cache=True)
         else:
-            prompt = construct_prompt_single(item['user_query'], item['code'], item['rubric'], eval_type)
-    else:
-        if with_image:
-            prompt = construct_prompt_pair(item['user_query'], item['code_a'], item['code_b'], item['rubric'], eval_type, item['image_a'], item['image_b'])
+            rubric_text = rubric_output(rubrics_map[item['question_id']], args.mode, args.rubric_type, args.prefix_cache)
+        if args.mode == "single" and not args.joint_single:
+            for model in ["a", "b"]:
+                yield {
+                    "question_id": item['question_id'],
+                    "model": model,
+                    "user_query": item['user_query'],
+                    "code": item[f"code_{model}"],
+                    "image": os.path.join(args.screenshots_dir, f"{item['question_id']}_{model}.png"),
+                    "rubric": rubrics_map[item['question_id']],
+                    "rubric_text": rubric_text
+                }
         else:
-            prompt = construct_prompt_pair(item['user_query'], item['code_a'], item['code_b'], item['rubric'], eval_type)
-    
-    response = None
-    metadata = None
-    max_retries = 5
-    for i in range(max_retries):
-        response, metadata = generate(model=model, messages=prompt)
-        try:
-            extract_and_parse_json(response)
-            break
-        except Exception as e:
-            if i < max_retries - 1:
-                print(f"Attempt {i+1} failed to parse JSON for item {item.get('question_id', 'unknown')}, retrying...")
-            else:
-                print(f"Item {item.get('question_id', 'unknown')} failed to parse JSON after {max_retries} attempts. Returning last response.")
-
-    if mode == "pair":
-        return {
-            "question_id": item['question_id'],
-            "model_response": response,
-            "metadata": metadata,
-        }
-    else:
-        return {
-            "question_id": item['question_id'],
-            "model": item['model'],
-            "model_response": response,
-            "metadata": metadata,
-        }
+            yield {
+                "question_id": item['question_id'],
+                "user_query": item['user_query'],
+                "code_a": item['code_a'],
+                "code_b": item['code_b'],
+                "image_a": os.path.join(args.screenshots_dir, f"{item['question_id']}_a.png"),
+                "image_b": os.path.join(args.screenshots_dir, f"{item['question_id']}_b.png"),
+                "rubric": rubrics_map[item['question_id']],
+                "rubric_text": rubric_text
+            }
 
 
 def main(args):
     total_tokens = {
         "prompt_token_count": 0,
         "candidates_token_count": 0,
-        "thoughts_token_count": 0
+        "thoughts_token_count": 0,
+        "cached_token_count": 0
     }
-    with open(args.data_path, "r") as f:
-        data = [json.loads(line) for line in f]
-    with open(args.rubric_path, "r") as f:
-        rubrics = [json.loads(line) for line in f]
-    rubrics_map = {item['question_id']: item["rubric_tree"] for item in rubrics}
-    items = []
-    for item in data:
-        if args.mode == "single":
-            for model in ["a", "b"]:
-                items.append({
-                    "question_id": item['question_id'],
-                    "model": model,
-                    "user_query": " ".join([i['content'][0]["text"] for i in item['conversation_a'] if i['role'] == 'user']),
-                    "code": item[f"conversation_{model}"][-1]['object']['code'],
-                    "image": os.path.join(args.screenshots_dir, f"{item['question_id']}_{model}.png"),
-                    "rubric": rubrics_map[item['question_id']]
-                })
+    # with --joint_single both sides of a question are judged in one request and written as two single-mode records
+    item_mode = "joint" if args.mode == "single" and args.joint_single else args.mode
+    rubrics_map = load_rubrics(args.rubric_path)
+    items = iter_items(args, rubrics_map)
+    total = count_records(args.data_path) * (2 if item_mode == "single" else 1)
+    output_filename = f"rubric_{args.model}_{args.mode}_{args.rubric_type}_{'with_image' if args.with_image else 'no_image'}.jsonl"
+    output_path = os.path.join(args.output_dir, output_filename)
+    if args.resume:
+        key_fields = ["question_id", "model"] if args.mode == "single" else ["question_id"]
+        finished = load_finished_keys(output_path, key_fields)
+        # only the questions left to judge are read from the dataset, looked up through its index
+        items = iter_items(args, rubrics_map, unfinished_questions(load_index(args.data_path), finished, key_fields))
+        if item_mode == "joint":
+            items = (item for item in items if not {(item["question_id"], "a"), (item["question_id"], "b")} <= finished)
+            total -= len(finished) // 2
         else:
-            items.append({
-                "question_id": item['question_id'],
-                "user_query": " ".join([i['content'][0]["text"] for i in item['conversation_a'] if i['role'] == 'user']),
-                "code_a": item['conversation_a'][-1]['object']['code'],
-                "code_b": item['conversation_b'][-1]['object']['code'],
-                "image_a": os.path.join(args.screenshots_dir, f"{item['question_id']}_a.png"),
-                "image_b": os.path.join(args.screenshots_dir, f"{item['question_id']}_b.png"),
-                "rubric": rubrics_map[item['question_id']]
-            })
-    print(f"Processing {len(items)} items")
-
-    results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=50) as executor:
-        future_to_item = {executor.submit(process_item, item, args.mode, args.with_image, args.rubric_type, args.model): item for item in items}
-        for future in tqdm(concurrent.futures.as_completed(future_to_item), total=len(future_to_item)):
+            items = (item for item in items if tuple(item[field] for field in key_fields) not in finished)
+            total -= len(finished)
+        print(f"Resuming: {len(finished)} items already finished")
+    print(f"Processing {total} items")
+
+    if args.batch:
+        batch_dir = os.path.join(args.output_dir, "batches", os.path.splitext(os.path.basename(output_path))[0])
+        requests = (
+            (batch_custom_id(item), args.model, build_prompt(item, item_mode, args.with_image, args.rubric_type, args.prefix_cache), {"max_tokens": 16384, "temperature": 0.0})
+            for item in items
+        )
+        with JsonlWriter(output_path, append=args.resume) as writer:
+            for custom_id, response, metadata in tqdm(run_batch(requests, batch_dir, args.model, args.batch_backend, args.batch_poll_interval)):
+                results = build_result(batch_item(custom_id), item_mode, response, metadata, args.rubric_type)
+                for result in (results if item_mode == "joint" else [results]):
+                    writer.write(result)
+                add_usage(total_tokens, metadata)
+        print(f"Total tokens: {total_tokens}")
+        return
+
+    if args.use_async:
+        executor, process_fn = AsyncExecutor(max_concurrency=args.max_concurrency), aprocess_item
+        max_pending = 2 * args.max_concurrency
+    else:
+        executor, process_fn = concurrent.futures.ThreadPoolExecutor(max_workers=50), process_item
+        max_pending = 2 * 50
+    with executor, JsonlWriter(output_path, append=args.resume) as writer:
+        completed = iter_completed(executor, process_fn, items, item_mode, args.with_image, args.rubric_type, args.model, args.prefix_cache, args.stream, max_pending=max_pending)
+        for future in tqdm(completed, total=total):
             try:
-                result = future.result()
-                results.append(result)
+                results = future.result()
+                for result in (results if item_mode == "joint" else [results]):
+                    writer.write(result)
 
-                metadata = result["metadata"]
-                total_tokens["prompt_token_count"] += metadata["prompt_token_count"]
-                total_tokens["candidates_token_count"] += metadata["candidates_token_count"]
-                total_tokens["thoughts_token_count"] += metadata["thoughts_token_count"]
+                    add_usage(total_tokens, result["metadata"])
             except Exception as e:
                 print(f"Error processing item: {e}")
     print(f"Total tokens: {total_tokens}")
-    output_filename = f"rubric_{args.model}_{args.mode}_{args.rubric_type}_{'with_image' if args.with_image else 'no_image'}.jsonl"
-    with open(os.path.join(args.output_dir, output_filename), "w") as f:
-        for result in results:
-            f.write(json.dumps(result, ensure_ascii=False) + "\n")
-
-
-def count_scores_pair(rubric_part):
-    a, b = 0, 0
-    if isinstance(rubric_part, dict):
-        if "value" in rubric_part and isinstance(rubric_part["value"], str):
-            if rubric_part["value"] == "A":
-                a += 1
-            elif rubric_part["value"] == "B":
-                b += 1
-        if "children" in rubric_part and rubric_part["children"] is not None:
-            for child in rubric_part["children"]:
-                child_a, child_b = count_scores_pair(child)
-                a += child_a
-                b += child_b
-    return a, b
-
-def count_true_values(rubric_result):
-    count = 0
-    if isinstance(rubric_result, dict):
-        if "value" in rubric_result and rubric_result["value"] is True:
-            count += 1
-        if "children" in rubric_result and rubric_result["children"] is not None:
-            for child in rubric_result["children"]:
-                count += count_true_values(child)
-    return count
 
 
+def load_rubric_table(args, result_path):
+    return load_table(
+        result_path,
+        lambda: parse_rubric_results(tqdm(iter_records(result_path)), args.mode, args.rubric_type, load_rubric_index(args.rubric_path)),
+        depends=[args.rubric_path],
+    )
+
 
 def evaluate_binary(args):
     result_path = os.path.join(args.output_dir, f"rubric_{args.model}_{args.mode}_{args.rubric_type}_{'with_image' if args.with_image else 'no_image'}.jsonl")
     weights = {"intention": 1, "static": 1, "dynamic": 1}
-    def count_leaf_nodes(rubric_part):
-        return json.dumps(rubric_part, indent=4).count('\"children\": null')
-
-
-    with open(args.data_path, "r") as f:
-        data = [json.loads(line) for line in f]
-
-    with open(args.rubric_path, "r") as f:
-        rubrics = [json.loads(line) for line in f]
-    rubrics_map = {item['question_id']: item["rubric_tree"] for item in rubrics}
-
-    labels = {item["question_id"]: item["label"] for item in data}
-    with open(result_path, "r") as f:
-        results = [json.loads(line) for line in f]
-    
-    pred = {}
-    error_count = 0
-    
-    if args.mode == "pair":
-        for result in tqdm(results):
-            try:
-                response = extract_and_parse_json(result["model_response"])
-                score_a = {key: 0 for key in ["intention", "static", "dynamic"]}
-                score_b = {key: 0 for key in ["intention", "static", "dynamic"]}
-                
-                if args.rubric_type == "combined":
-                    for key in ["intention", "static", "dynamic"]:
-                        if key in response:
-                            a,b = count_scores_pair(response[key])
-                            score_a[key] += a
-                            score_b[key] += b
-                        else:
-                            print(f"Key {key} not in response for question {result['question_id']}")
-                            error_count += 1
-                else:
-                    a, b = count_scores_pair(response)
-                    score_a[args.rubric_type] += a
-                    score_b[args.rubric_type] += b
-
-
-                intention_leaves = count_leaf_nodes(rubrics_map[result["question_id"]]["intention"])
-                static_leaves = count_leaf_nodes(rubrics_map[result["question_id"]]["static"])
-                dynamic_leaves = count_leaf_nodes(rubrics_map[result["question_id"]]["dynamic"])
-
-                total_score_a = 0
-                total_score_b = 0
-                # default: combined mode
-                if args.rubric_type == "combined":
-                    if intention_leaves > 0:
-                        total_score_a += score_a["intention"] * weights["intention"] / intention_leaves
-                        total_score_b += score_b["intention"] * weights["intention"] / intention_leaves
-                    if static_leaves > 0:
-                        total_score_a += score_a["static"] * weights["static"] / static_leaves
-                        total_score_b += score_b["static"] * weights["static"] / static_leaves
-                    if dynamic_leaves > 0:
-                        total_score_a += score_a["dynamic"] * weights["dynamic"] / dynamic_leaves
-                        total_score_b += score_b["dynamic"] * weights["dynamic"] / dynamic_leaves
-                else:
-                    total_score_a = score_a[args.rubric_type]
-                    total_score_b = score_b[args.rubric_type]
-
-                if total_score_a > total_score_b:
-                    pred[result["question_id"]] = "model_a"
-                elif total_score_b > total_score_a:
-                    pred[result["question_id"]] = "model_b"
-                else:
-                    pred[result["question_id"]] = "tie"
-            except Exception as e:
-                print(f"Error: {e}")
-                pred[result["question_id"]] = "error"
-                error_count += 1
-                continue
-    else: # single mode
-         for result in tqdm(results):
-            try:
-                response = extract_and_parse_json(result["model_response"])
-                score = {key: 0 for key in ["intention", "static", "dynamic"]}
-                if args.rubric_type == "combined":
-                    for key in ["intention", "static", "dynamic"]:
-                        if key in response:
-                            score[key] += count_true_values(response[key])
-                        else:
-                            print(f"Key {key} not in response for question {result['question_id']}")
-                            error_count += 1
-                else:
-                    score = count_true_values(response)
-                
-                intention_leaves = count_leaf_nodes(rubrics_map[result["question_id"]]["intention"])
-                static_leaves = count_leaf_nodes(rubrics_map[result["question_id"]]["static"])
-                dynamic_leaves = count_leaf_nodes(rubrics_map[result["question_id"]]["dynamic"])
-                # default: combined mode
-                total_score = 0
-                if args.rubric_type == "combined":
-                    if intention_leaves > 0:
-                        total_score += score["intention"] * weights["intention"] / intention_leaves
-                    if static_leaves > 0:
-                        total_score += score["static"] * weights["static"] / static_leaves
-                    if dynamic_leaves > 0:
-                        total_score += score["dynamic"] * weights["dynamic"] / dynamic_leaves
-                else:
-                    total_score = score
-
-                if result["question_id"] not in pred:
-                    pred[result["question_id"]] = {}
-                pred[result["question_id"]][result["model"]] = total_score
-            except Exception as e:
-                print(f"Error: {e}")
-                if result["question_id"] not in pred:
-                    pred[result["question_id"]] = {}
-                pred[result["question_id"]][result["model"]] = "error"
-                error_count += 1
-                continue
-        
-         for qid, scores in pred.items():
-            if "a" not in scores or "b" not in scores or scores["a"] == "error" or scores["b"] == "error":
-                pred[qid] = "error"
-                continue
-            if scores["a"] > scores["b"]:
-                pred[qid] = "model_a"
-            elif scores["b"] > scores["a"]:
-                pred[qid] = "model_b"
-            else:
-                pred[qid] = "tie"
-
-    acc = 0
-    a_acc = 0
-    a_count = 0
-    b_acc = 0
-    b_count = 0
-    tie_acc = 0
-    tie_count = 0
-    
-    for key in pred:
-        if key not in labels: 
+
+    labels = load_labels(args.data_path)
+    table = load_rubric_table(args, result_path)
+    pred = predict(table, rubric_scores(table, args.rubric_type, weights))
+    for key in pred.index:
+        if key not in labels:
             print(f"Question {key} not in labels")
-            continue
-        if pred[key] == "error":
-            continue
-        if labels[key] == "model_a": a_count += 1
-        elif labels[key] == "model_b": b_count += 1
-        else: tie_count += 1
-        
-        if pred[key] == labels[key]:
-            acc += 1
-            if pred[key] == "model_a": a_acc += 1
-            elif pred[key] == "model_b": b_acc += 1
-            else: tie_acc += 1
-
-    print(f"Total evaluated: {len(pred)}, error count: {error_count}")
-    print(f"Accuracy: {acc / len(pred) if len(pred) > 0 else 0}")
-    balanced_acc = (a_acc / a_count + b_acc / b_count + tie_acc / tie_count) / 3
-    label_column = []
-    pred_column = []
-    id_column = []
-    for key in pred:
-        label_column.append(labels[key])
-        pred_column.append(pred[key])
-        id_column.append(key)
-    df = pd.DataFrame({"question_id": id_column, "label": label_column, "pred": pred_column})
+    metrics = compute_metrics(pred, labels, count_errors=False)
+
+    # tables cached before the error count was recorded fall back to the failed rows
+    print(f"Total evaluated: {len(pred)}, error count: {table.attrs.get('error_count', int(table['error'].sum()))}")
+    print(f"Accuracy: {metrics['acc']}")
+    df = pd.DataFrame({"question_id": pred.index, "label": [labels.get(key) for key in pred.index], "pred": pred.to_numpy()})
     if not os.path.exists("results"):
         os.makedirs("results")
     df.to_csv(f"results/rubric_{args.model}_{args.mode}_{args.rubric_type}_{'with_image' if args.with_image else 'no_image'}_binary.csv", index=False)
 
-    return acc, balanced_acc
+    return metrics["correct"], metrics["balanced_acc"]
+
+
+def sweep_weights(args, weight_grid, thresholds=(0,)):
+    """
+    Accuracy and balanced accuracy of evaluate_binary() for every weight vector of the grid (combined
+    rubrics only) and every threshold on the score difference, from a single parse of the outputs.
+    """
+    result_path = os.path.join(args.output_dir, f"rubric_{args.model}_{args.mode}_{args.rubric_type}_{'with_image' if args.with_image else 'no_image'}.jsonl")
+    labels = load_labels(args.data_path)
+    table = load_rubric_table(args, result_path)
+    if args.rubric_type == "combined":
+        weight_grid = list(weight_grid)
+        df = sweep(table, rubric_score_matrix(table, weight_grid), labels, thresholds, count_errors=False)
+        for key in BRANCHES:
+            df[key] = [weight_grid[i][key] for i in df["setting"]]
+        df = df[BRANCHES + ["threshold", "correct", "acc", "balanced_acc"]]
+    else:
+        df = sweep(table, rubric_scores(table, args.rubric_type), labels, thresholds, count_errors=False).drop(columns="setting")
+    print(df.to_string(index=False))
+    best = df.loc[df["balanced_acc"].idxmax()]
+    print(f"Best setting: {best.to_dict()}")
+    if not os.path.exists("results"):
+        os.makedirs("results")
+    df.to_csv(f"results/rubric_{args.model}_{args.mode}_{args.rubric_type}_{'with_image' if args.with_image else 'no_image'}_sweep.csv", index=False)
+    return df
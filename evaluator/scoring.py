@@ -0,0 +1,272 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from utils.basic import extract_and_parse_json
+from utils.rubric_index import BRANCHES, flatten_tree, VALUE_A, VALUE_B, VALUE_TRUE
+
+
+CLASSES = ["model_a", "model_b", "tie"]
+
+
+def likert_judgment(parsed, mode, side=None):
+    """Normalized likert judgment: side -> {criterion: score}."""
+    if mode == "pair":
+        return {"a": {key: value["A"] for key, value in parsed.items()},
+                "b": {key: value["B"] for key, value in parsed.items()}}
+    return {side: dict(parsed)}
+
+
+def rubric_judgment(parsed, rubric_type):
+    """Normalized rubric judgment: branch -> value codes of the judged tree in flat pre-order (see flatten_tree)."""
+    if rubric_type == "combined":
+        trees = {key: parsed[key] for key in BRANCHES if key in parsed}
+    else:
+        trees = {rubric_type: parsed}
+    return {key: flatten_tree(tree)["value"] for key, tree in trees.items()}
+
+
+def normalize_judgment(normalize, parsed, *args):
+    """normalize(parsed, *args), or None when there is no parsed judgment or it does not have the expected shape."""
+    if parsed is None:
+        return None
+    try:
+        return normalize(parsed, *args)
+    except Exception:
+        return None
+
+
+def result_judgment(result, normalize, *args):
+    """
+    The normalized judgment stored with the result by the generation stage, so scoring does not touch
+    the raw response; older outputs without it are normalized from their raw response.
+    """
+    if "judgment" not in result:
+        return normalize(extract_and_parse_json(result["model_response"]), *args)
+    if result["judgment"] is None:
+        raise ValueError("No valid judgment in response")
+    return result["judgment"]
+
+
+def parse_likert_results(results, mode):
+    """
+    Parse every likert judgment once into a table with one row per (question_id, side):
+    the per-criterion scores as columns, their sum in "score", and an "error" flag.
+    """
+    rows = []
+    for result in results:
+        try:
+            sides = result_judgment(result, likert_judgment, mode, result.get("model"))
+            for side, criteria in sides.items():
+                rows.append({"question_id": result["question_id"], "side": side, "error": False,
+                             "score": sum(criteria.values()), **criteria})
+        except Exception as e:
+            print(f"Error: {e}")
+            for side in (["a", "b"] if mode == "pair" else [result["model"]]):
+                rows.append({"question_id": result["question_id"], "side": side, "error": True, "score": np.nan})
+    return _to_table(rows)
+
+
+def parse_rubric_results(results, mode, rubric_type, rubric_index):
+    """
+    Parse every rubric judgment once into a table with one row per (question_id, side) holding the
+    number of leaves won (pair) or satisfied (single) per branch, the number of rubric leaves per
+    branch ("<branch>_leaves", from the rubric index) and an "error" flag. table.attrs["error_count"] is
+    the number of records that failed plus, for combined rubrics, the number of branches missing from
+    a judgment, counted over every record of the file like the original evaluation.
+    Judged trees are flattened (see utils.rubric_index.flatten_tree) into one array of value codes for
+    the whole file, and the per-branch counts of all rows are computed with a single bincount.
+    """
+    rows = []
+    error_count = 0
+    # per judged node: its value code and the (row, branch) slot it counts towards
+    values = []
+    slots = []
+    for result in results:
+        sides = ["a", "b"] if mode == "pair" else [result["model"]]
+        try:
+            flats = result_judgment(result, rubric_judgment, rubric_type)
+            branches = rubric_index[result["question_id"]]["branches"]
+            leaves = {f"{key}_leaves": branches[key]["leaves"] for key in BRANCHES}
+            if rubric_type == "combined":
+                for key in BRANCHES:
+                    if key not in flats:
+                        print(f"Key {key} not in response for question {result['question_id']}")
+                        error_count += 1
+        except Exception as e:
+            print(f"Error: {e}")
+            error_count += 1
+            for side in sides:
+                rows.append({"question_id": result["question_id"], "side": side, "error": True})
+            continue
+        row = len(rows)
+        for side in sides:
+            rows.append({"question_id": result["question_id"], "side": side, "error": False, **leaves})
+        for key, flat in flats.items():
+            values.extend(flat)
+            slots.extend([row * len(BRANCHES) + BRANCHES.index(key)] * len(flat))
+
+    values = np.array(values, dtype=np.int8)
+    slots = np.array(slots, dtype=np.int64)
+    if mode == "pair":
+        # "A" counts for the row of side a, "B" for the next row (side b)
+        counted = (values == VALUE_A) | (values == VALUE_B)
+        slots = slots + len(BRANCHES) * (values == VALUE_B)
+    else:
+        counted = values == VALUE_TRUE
+    counts = np.bincount(slots[counted], minlength=len(rows) * len(BRANCHES)).reshape(len(rows), len(BRANCHES))
+
+    table = pd.DataFrame(rows, columns=None if rows else ["question_id", "side", "error"])
+    if rows:
+        table[BRANCHES] = np.where(table["error"].to_numpy()[:, None], np.nan, counts)
+    table = _dedup(table)
+    table.attrs["error_count"] = error_count
+    return table
+
+
+def _to_table(rows):
+    return _dedup(pd.DataFrame(rows, columns=None if rows else ["question_id", "side", "error"]))
+
+
+def _dedup(table):
+    # a resumed run may contain several judgments for the same key, the last one wins
+    return table.drop_duplicates(subset=["question_id", "side"], keep="last").reset_index(drop=True)
+
+
+def parsed_table_path(result_path):
+    return os.path.splitext(result_path)[0] + ".parsed.pkl"
+
+
+def _stamp(paths):
+    return [(path, os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in paths]
+
+
+def load_table(result_path, parse, depends=()):
+    """
+    Parsed table of an output file, cached as `<name>.parsed.pkl` next to it. The cache is keyed by the
+    size and mtime of the output file and of any other file the parse `depends` on (e.g. the rubrics),
+    so re-evaluating a finished run, or sweeping its settings, does not re-read and re-parse the JSONL.
+    """
+    cache_path = parsed_table_path(result_path)
+    stamp = _stamp([result_path, *depends])
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                cached = pickle.load(f)
+            if cached["stamp"] == stamp:
+                return cached["table"]
+        except Exception as e:
+            print(f"Ignoring parsed table cache {cache_path}: {e}")
+    table = parse()
+    with open(cache_path, "wb") as f:
+        pickle.dump({"stamp": stamp, "table": table}, f)
+    return table
+
+
+def rubric_scores(table, rubric_type="combined", weights=None):
+    """Per-row rubric score: weighted sum of leaf-normalized branch counts (combined) or the raw branch count."""
+    if rubric_type != "combined":
+        return table[rubric_type].astype(float)
+    weights = weights or {key: 1 for key in BRANCHES}
+    total = np.zeros(len(table))
+    for key in BRANCHES:
+        leaves = table[f"{key}_leaves"].to_numpy(dtype=float)
+        counts = table[key].to_numpy(dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            total += np.where(leaves > 0, counts * weights[key] / leaves, 0.0)
+    return pd.Series(total, index=table.index)
+
+
+def predict(table, scores, threshold=0):
+    """
+    Pairwise prediction per question from per-side scores: "model_a" if a > b + threshold,
+    "model_b" if a < b - threshold, "tie" otherwise, and "error" if a side failed or is missing.
+    """
+    frame = pd.DataFrame({"question_id": table["question_id"], "side": table["side"],
+                          "score": scores.where(~table["error"].astype(bool))})
+    wide = frame.pivot(index="question_id", columns="side", values="score").reindex(columns=["a", "b"])
+    score_a = wide["a"].to_numpy(dtype=float)
+    score_b = wide["b"].to_numpy(dtype=float)
+    pred = np.select([score_a > score_b + threshold, score_a < score_b - threshold], ["model_a", "model_b"], "tie")
+    pred = np.where(np.isnan(score_a) | np.isnan(score_b), "error", pred)
+    # keep the order in which questions first appear in the results
+    order = pd.unique(table["question_id"])
+    return pd.Series(pred, index=wide.index).reindex(order)
+
+
+def compute_metrics(pred, labels, count_errors=True):
+    """
+    Number of correct predictions, accuracy (errors count as wrong) and balanced accuracy over the three classes.
+    With count_errors=False, errored predictions are left out of the per-class denominators.
+    """
+    label = pd.Series(labels).reindex(pred.index)
+    known = label.notna().to_numpy()
+    counted = known if count_errors else known & (pred != "error").to_numpy()
+    correct = (pred.to_numpy() == label.to_numpy()) & known
+    acc = int(correct.sum())
+    per_class = []
+    for cls in CLASSES:
+        mask = counted & (label == cls).to_numpy()
+        per_class.append(correct[mask].sum() / mask.sum() if mask.sum() > 0 else np.nan)
+    balanced_acc = float(np.mean(per_class))
+    return {"correct": acc, "acc": acc / len(pred) if len(pred) > 0 else 0, "balanced_acc": balanced_acc}
+
+
+def rubric_score_matrix(table, weight_grid):
+    """Rubric scores of every row under every weight vector of the grid at once: (rows, len(weight_grid))."""
+    counts = table[BRANCHES].to_numpy(dtype=float)
+    leaves = table[[f"{key}_leaves" for key in BRANCHES]].to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        normalized = np.where(leaves > 0, counts / leaves, 0.0)
+    weights = np.array([[weights[key] for key in BRANCHES] for weights in weight_grid], dtype=float)
+    return normalized @ weights.T
+
+
+def sweep(table, score_matrix, labels, thresholds, count_errors=True):
+    """
+    Evaluate every (score column, threshold) pair in one vectorized pass. score_matrix holds one column
+    of per-row scores per setting (e.g. per weight vector); the result has one row per setting and
+    threshold with the number of correct predictions, accuracy and balanced accuracy, with the same
+    semantics as predict + compute_metrics.
+    """
+    score_matrix = np.asarray(score_matrix, dtype=float).reshape(len(table), -1)
+    score_matrix = np.where(table["error"].astype(bool).to_numpy()[:, None], np.nan, score_matrix)
+    order = pd.unique(table["question_id"])
+    positions = pd.DataFrame({"question_id": table["question_id"], "side": table["side"], "row": np.arange(len(table))})
+    positions = positions.pivot(index="question_id", columns="side", values="row").reindex(index=order, columns=["a", "b"])
+
+    def side_scores(side):
+        rows = positions[side].to_numpy(dtype=float)
+        present = ~np.isnan(rows)
+        scores = np.full((len(order), score_matrix.shape[1]), np.nan)
+        scores[present] = score_matrix[rows[present].astype(int)]
+        return scores
+
+    diff = side_scores("a") - side_scores("b")
+    thresholds = np.asarray(thresholds, dtype=float)
+    # (questions, settings, thresholds); 0/1/2 index CLASSES, -1 is an error
+    diff = diff[:, :, None]
+    pred = np.select([diff > thresholds, diff < -thresholds], [0, 1], 2)
+    pred = np.where(np.isnan(diff), -1, pred)
+
+    label = pd.Series(labels).reindex(order)
+    known = label.notna().to_numpy()[:, None, None]
+    label = label.map({cls: i for i, cls in enumerate(CLASSES)}).fillna(-2).to_numpy()[:, None, None]
+    counted = known if count_errors else known & (pred != -1)
+    correct = (pred == label) & known
+    per_class = []
+    for i in range(len(CLASSES)):
+        mask = counted & (label == i)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            per_class.append((correct & mask).sum(axis=0) / mask.sum(axis=0))
+    balanced_acc = np.mean(per_class, axis=0)
+    n_correct = correct.sum(axis=0)
+
+    setting_index, threshold_index = np.meshgrid(np.arange(score_matrix.shape[1]), np.arange(len(thresholds)), indexing="ij")
+    return pd.DataFrame({
+        "setting": setting_index.ravel(),
+        "threshold": thresholds[threshold_index.ravel()],
+        "correct": n_correct.ravel(),
+        "acc": n_correct.ravel() / len(order) if len(order) > 0 else 0,
+        "balanced_acc": balanced_acc.ravel(),
+    })
@@ -0,0 +1,214 @@
+import os
+import json
+import shutil
+import argparse
+import threading
+import subprocess
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from utils.task_queue import read_webs
+
+
+MANIFEST = "manifest.json"
+BUILD_TIMEOUT = 3600
+# static export that does not fail on type or lint errors of the generated pages
+NEXT_CONFIG = """/** Written by gui_build.py: static export of the pages of webs.txt. */
+module.exports = {
+  output: "export",
+  trailingSlash: true,
+  images: { unoptimized: true },
+  typescript: { ignoreBuildErrors: true },
+  eslint: { ignoreDuringBuilds: true },
+};
+"""
+
+
+def page_route(line):
+    """URL path of the page built from line `line` of webs.txt."""
+    return f"/web_{line}/"
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_manifest(static_dir):
+    """line (as str) -> {"web_dir", "route", "status": "built" | "failed", "stamp"} of the pre-built pages."""
+    path = os.path.join(static_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _save_manifest(static_dir, manifest):
+    path = os.path.join(static_dir, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+def static_page_url(manifest, base_url, line, web_dir):
+    """URL of the pre-built page of a webs.txt line, or None if it was not built from the current index.tsx."""
+    entry = manifest.get(str(line))
+    if entry is None or entry["status"] != "built" or entry["web_dir"] != web_dir:
+        return None
+    index_tsx_path = os.path.join(web_dir, "index.tsx")
+    if not os.path.isfile(index_tsx_path) or entry["stamp"] != _stamp(index_tsx_path):
+        return None
+    return base_url + entry["route"]
+
+
+def prepare_workspace(workspace):
+    """Switch a dedicated Next.js workspace to static export (other next.config files are moved aside)."""
+    for name in ["next.config.ts", "next.config.mjs", "next.config.cjs"]:
+        path = os.path.join(workspace, name)
+        if os.path.exists(path):
+            os.replace(path, path + ".bak")
+    with open(os.path.join(workspace, "next.config.js"), "w") as f:
+        f.write(NEXT_CONFIG)
+
+
+def _clear_pages(workspace):
+    # keep _app/_document, drop everything else (including API routes, which static export rejects)
+    pages_dir = os.path.join(workspace, "pages")
+    for name in os.listdir(pages_dir):
+        if name.startswith("_"):
+            continue
+        path = os.path.join(pages_dir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def next_build(workspace, pages, log_path):
+    """`next build` of the (line, web_dir) pages as routes of the workspace; True if every page was exported."""
+    _clear_pages(workspace)
+    for line, web_dir in pages:
+        page_dir = os.path.join(workspace, "pages", page_route(line).strip("/"))
+        os.makedirs(page_dir)
+        shutil.copyfile(os.path.join(web_dir, "index.tsx"), os.path.join(page_dir, "index.tsx"))
+    shutil.rmtree(os.path.join(workspace, "out"), ignore_errors=True)
+    with open(log_path, "a") as log:
+        log.write(f"===== next build of lines {[line for line, _ in pages]} =====\n")
+        log.flush()
+        try:
+            returncode = subprocess.run(["npx", "next", "build"], cwd=workspace, stdout=log, stderr=subprocess.STDOUT,
+                                        timeout=BUILD_TIMEOUT).returncode
+        except subprocess.TimeoutExpired:
+            return False
+    out_dir = os.path.join(workspace, "out")
+    return returncode == 0 and all(
+        os.path.exists(os.path.join(out_dir, page_route(line).strip("/"), "index.html")) for line, _ in pages
+    )
+
+
+def _collect(workspace, pages, static_dir):
+    out_dir = os.path.join(workspace, "out")
+    # chunk names are content hashes, so the assets of all builds can share one _next directory
+    shutil.copytree(os.path.join(out_dir, "_next"), os.path.join(static_dir, "_next"), dirs_exist_ok=True)
+    for line, _ in pages:
+        route_dir = page_route(line).strip("/")
+        shutil.rmtree(os.path.join(static_dir, route_dir), ignore_errors=True)
+        shutil.copytree(os.path.join(out_dir, route_dir), os.path.join(static_dir, route_dir))
+
+
+def build_batch(workspace, pages, static_dir, manifest, log_path):
+    """
+    Build the pages together; if the build fails, split the batch in halves and build those, so a page
+    that does not compile or prerender only fails itself. Failed pages are recorded in the manifest and
+    fall back to the dev server at run time.
+    """
+    if next_build(workspace, pages, log_path):
+        _collect(workspace, pages, static_dir)
+        status = "built"
+    elif len(pages) > 1:
+        middle = len(pages) // 2
+        build_batch(workspace, pages[:middle], static_dir, manifest, log_path)
+        build_batch(workspace, pages[middle:], static_dir, manifest, log_path)
+        return
+    else:
+        status = "failed"
+    for line, web_dir in pages:
+        manifest[str(line)] = {
+            "web_dir": web_dir,
+            "route": page_route(line),
+            "status": status,
+            "stamp": _stamp(os.path.join(web_dir, "index.tsx")),
+        }
+    _save_manifest(static_dir, manifest)
+
+
+def build_pages(webs, workspace, static_dir, batch_size=50, rebuild=False):
+    """
+    Pre-build the index.tsx of every (line, web_dir) page as a static route of one workspace, in batches
+    of batch_size pages per `next build`. Pages whose index.tsx has not changed since their last build
+    (or failed build) are skipped unless rebuild is set. Returns the manifest.
+    """
+    os.makedirs(static_dir, exist_ok=True)
+    manifest = {} if rebuild else load_manifest(static_dir)
+    log_path = os.path.join(static_dir, "build.log")
+    pending = []
+    for line, web_dir in webs:
+        index_tsx_path = os.path.join(web_dir, "index.tsx")
+        if not web_dir or not os.path.isfile(index_tsx_path):
+            continue
+        entry = manifest.get(str(line))
+        if entry is None or entry["web_dir"] != web_dir or entry["stamp"] != _stamp(index_tsx_path):
+            pending.append((line, web_dir))
+    print(f"Building {len(pending)} pages ({len(webs) - len(pending)} up to date or missing)")
+    if not pending:
+        return manifest
+    prepare_workspace(workspace)
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        print(f"Building pages {start + 1}-{start + len(batch)} of {len(pending)}")
+        build_batch(workspace, batch, static_dir, manifest, log_path)
+    counts = {}
+    for entry in manifest.values():
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+    print(f"Pages: {counts}, build log: {log_path}")
+    return manifest
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class StaticServer:
+    """The pre-built pages served from a ThreadingHTTPServer in a background thread of the worker."""
+    def __init__(self, static_dir, port, host="localhost"):
+        self.httpd = ThreadingHTTPServer((host, port), partial(_QuietHandler, directory=static_dir))
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--webs", type=str, default="webs.txt")
+    parser.add_argument("--start_line", type=int, default=1)
+    parser.add_argument("--end_line", type=int, default=None)
+    # a workspace set up like the workers' ones (envs/set_up_nextjs_env.sh), used only for building
+    parser.add_argument("--workspace", type=str, default="workspace/workspace_build")
+    parser.add_argument("--static_dir", type=str, default="static_pages")
+    parser.add_argument("--batch_size", type=int, default=50)
+    parser.add_argument("--rebuild", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not os.path.isdir(args.workspace):
+        raise SystemExit(f"Error: Next.js workspace '{args.workspace}' not found. "
+                         f"You can use 'bash envs/set_up_nextjs_env.sh {args.workspace}' to set it up.")
+    build_pages(read_webs(args.webs, args.start_line, args.end_line), args.workspace, args.static_dir, args.batch_size, args.rebuild)
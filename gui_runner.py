@@ -0,0 +1,231 @@
+import os
+import time
+import shutil
+import signal
+import sys
+import socket
+import argparse
+import subprocess
+from utils.task_queue import TaskQueue, pending_tasks, read_webs
+from gui_build import StaticServer, load_manifest, static_page_url
+
+
+SCREEN_WIDTH, SCREEN_HEIGHT = 1920, 1080
+SERVER_START_TIMEOUT = 30
+
+
+def wait_for_port(port, host="localhost", timeout=SERVER_START_TIMEOUT, process=None):
+    """Wait until something accepts connections on the port; False on timeout or if the process exits."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            return False
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def stop_process(process, timeout=10):
+    """Terminate a process started with start_new_session=True together with its children."""
+    if process is None or process.poll() is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+
+class NextServer:
+    """The Next.js dev server of a worker's workspace, restarted with the index.tsx of every web page."""
+    def __init__(self, workspace, port):
+        self.workspace = workspace
+        self.port = port
+        self.process = None
+
+    def start(self, index_tsx_path):
+        self.stop()
+        shutil.copyfile(index_tsx_path, os.path.join(self.workspace, "pages", "index.tsx"))
+        self.process = subprocess.Popen(
+            ["npm", "run", "dev", "--", "-p", str(self.port)],
+            cwd=self.workspace,
+            start_new_session=True,
+        )
+        if not wait_for_port(self.port, process=self.process):
+            self.stop()
+            return False
+        return True
+
+    def stop(self):
+        stop_process(self.process)
+        self.process = None
+
+
+def start_xvfb(display_num):
+    process = subprocess.Popen(
+        ["Xvfb", f":{display_num}", "-screen", "0", f"{SCREEN_WIDTH}x{SCREEN_HEIGHT}x24", "-ac", "+extension", "GLX", "+render", "-noreset"],
+        start_new_session=True,
+    )
+    time.sleep(2)  # Wait for Xvfb to start.
+    return process
+
+
+def run_web(server, host_url, i, web_dir, rerun_all=False, static_url=None):
+    """
+    Serve one web page and run the tasks of its tasks.txt that have not finished yet (see
+    utils.task_queue.task_finished; all of them with rerun_all); False if the page could not be served.
+    With the static_url of its pre-built page (see gui_build.py), the dev server is not started.
+    """
+    from run_gui_agent import logger, get_browser_session, run_task
+
+    logger.info("=" * 27)
+    logger.info(f"Processing web directory {i}: {web_dir}")
+    logger.info("=" * 27)
+    index_tsx_path = os.path.join(web_dir, "index.tsx")
+    tasks_file_path = os.path.join(web_dir, "tasks.txt")
+    if not os.path.isfile(index_tsx_path):
+        logger.error(f"index.tsx not found at {index_tsx_path}")
+        return False
+    if not os.path.isfile(tasks_file_path):
+        logger.error(f"tasks.txt not found at {tasks_file_path}")
+        return False
+
+    task_dirs = pending_tasks(tasks_file_path, rerun_all)
+    if not task_dirs:
+        logger.info(f"All tasks of {web_dir} have finished, skipping...")
+        return True
+
+    if static_url is not None:
+        host_url = static_url
+        logger.info(f"Using pre-built page {static_url}")
+    elif not server.start(index_tsx_path):
+        logger.error(f"Next.js dev server failed to start on port {server.port}.")
+        return False
+    else:
+        logger.info("Dev server is ready.")
+    session = get_browser_session()
+    for task_dir in task_dirs:
+        logger.info(f"--- Processing task: {task_dir} ---")
+        try:
+            run_task(task_dir, host_url, session)
+        except Exception as e:
+            logger.error(f"Task failed: {task_dir}: {e}")
+    server.stop()
+    return True
+
+
+def iter_queue(queue, worker_id):
+    while True:
+        claimed = queue.claim(worker_id)
+        if claimed is None:
+            return
+        yield claimed
+        queue.finish(claimed[0])
+
+
+def run_worker(args):
+    """
+    Process web pages of webs.txt in this process: for each page, serve its index.tsx from the
+    worker's Next.js workspace and run all tasks of its tasks.txt with the display's browser session.
+    The interpreter, the agent's imports and API clients and the browser stay warm across pages.
+    Pages are taken in order from --start_line..--end_line, or, with --queue, claimed one at a time
+    (longest first) from the queue shared with the other workers.
+    """
+    # pyautogui and the agent read the display when they are imported
+    from run_gui_agent import logger, close_browser_sessions
+
+    server = NextServer(args.workspace, args.port)
+    host_url = f"http://{args.host}:{args.port}"
+    webs = read_webs(args.webs, args.start_line, args.end_line)
+    manifest, static_server = {}, None
+    if args.static_dir is not None:
+        manifest = load_manifest(args.static_dir)
+        static_server = StaticServer(args.static_dir, args.static_port).start()
+        logger.info(f"Serving {args.static_dir} on port {args.static_port}")
+    static_base = f"http://{args.host}:{args.static_port}"
+    queue = None
+    if args.queue is not None:
+        queue = TaskQueue(args.queue)
+        queue.populate(webs, args.rerun_all)
+        webs = iter_queue(queue, args.worker_id)
+    try:
+        for n, (i, web_dir) in enumerate(webs):
+            # Pause between web directories.
+            if n > 0:
+                time.sleep(args.pause)
+            if not web_dir:
+                logger.warning(f"Empty line at {i} in {args.webs}, skipping...")
+                continue
+            run_web(server, host_url, i, web_dir, args.rerun_all, static_page_url(manifest, static_base, i, web_dir))
+        if queue is not None:
+            logger.info(f"Queue drained: {queue.counts()}")
+    finally:
+        server.stop()
+        close_browser_sessions()
+        if static_server is not None:
+            static_server.stop()
+        if queue is not None:
+            queue.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--display_num", type=int, default=99)
+    parser.add_argument("--start_line", type=int, default=1)
+    parser.add_argument("--end_line", type=int, default=None)
+    parser.add_argument("--worker_id", type=int, default=0)
+    parser.add_argument("--webs", type=str, default="webs.txt")
+    parser.add_argument("--workspace", type=str, default=None, help="default: workspace/workspace_<worker_id>")
+    parser.add_argument("--host", type=str, default="localhost")
+    parser.add_argument("--port", type=int, default=None, help="default: 3000 + worker_id")
+    parser.add_argument("--no_xvfb", action="store_true", help="use an already running display")
+    parser.add_argument("--pause", type=float, default=3)
+    # shared SQLite queue of the pages of --start_line..--end_line, for parallel workers
+    parser.add_argument("--queue", type=str, default=None)
+    # by default, tasks whose messages.json has a terminal final_result are skipped
+    parser.add_argument("--rerun_all", action="store_true")
+    # pages pre-built by gui_build.py; pages missing from it or whose build failed use the dev server
+    parser.add_argument("--static_dir", type=str, default=None)
+    parser.add_argument("--static_port", type=int, default=None, help="default: 4000 + worker_id")
+    parser.add_argument("--image_max_size", type=int, default=None)
+    parser.add_argument("--image_format", type=str, default="png", choices=["png", "palette", "jpeg", "webp"])
+    parser.add_argument("--image_quality", type=int, default=85)
+    args = parser.parse_args()
+    if args.workspace is None:
+        args.workspace = os.path.join("workspace", f"workspace_{args.worker_id}")
+    if args.port is None:
+        args.port = 3000 + args.worker_id
+    if args.static_port is None:
+        args.static_port = 4000 + args.worker_id
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not os.path.isdir(args.workspace):
+        raise SystemExit(f"Error: Next.js workspace '{args.workspace}' not found. "
+                         f"You can use 'bash envs/set_up_nextjs_env.sh {args.workspace}' to set it up.")
+    if not os.path.isfile(args.webs):
+        raise SystemExit(f"Error: {args.webs} not found")
+
+    os.environ["DISPLAY"] = f":{args.display_num}"
+    os.environ["SCREEN_WIDTH"], os.environ["SCREEN_HEIGHT"] = str(SCREEN_WIDTH), str(SCREEN_HEIGHT)
+    xvfb = None if args.no_xvfb else start_xvfb(args.display_num)
+    # stop the servers on SIGTERM as well (e.g. from run_parallel.sh)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+    try:
+        import pyautogui
+        from utils.basic import configure_images
+        # safe measures
+        pyautogui.PAUSE = 1.0  # pause 1 second after each pyautogui operation
+        pyautogui.FAILSAFE = True  # enable fail safe
+        configure_images(max_size=args.image_max_size, image_format=args.image_format, quality=args.image_quality)
+        run_worker(args)
+    finally:
+        stop_process(xvfb)
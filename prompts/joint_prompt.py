@@ -0,0 +1,20 @@
+JOINT_INSTRUCTIONS = """
+
+## Two Solutions
+Below, you will be given the user query and two independent solutions, A and B, to it, followed by the rubric when there is one. Evaluate each solution on its own, exactly as you would if it were the only solution: do not compare them, and do not let one solution influence the evaluation of the other. Instead of a single json object, end your output with one json object wrapped with ```json at the beginning and ``` at the end, with the keys "A" and "B", whose values are the json objects described in the output format above for solution A and solution B respectively. Do not include any other text after the json object.
+
+"""
+
+JOINT_INPUT = """## User Query
+{user_query}
+
+## Code A
+```tsx
+{code_a}
+```
+
+## Code B
+```tsx
+{code_b}
+```
+"""
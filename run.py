@@ -1,10 +1,16 @@
 import json
 import os
+import itertools
 from argparse import ArgumentParser
 from evaluator.rubric import main as rubric_main
 from evaluator.rubric import evaluate_binary as rubric_evaluate
+from evaluator.rubric import sweep_weights as rubric_sweep
 from evaluator.likert import main as likert_main
 from evaluator.likert import evaluate as likert_evaluate
+from evaluator.likert import sweep_thresholds as likert_sweep
+from utils import cache
+from utils.basic import configure_images
+from utils.get_response import configure_stream
 
 
 def parse_args():
@@ -14,19 +20,54 @@ def parse_args():
     parser.add_argument("--mode", type=str, default="pair", choices=["single", "pair"])
     parser.add_argument("--with_image", action="store_true")
     parser.add_argument("--eval", action="store_true")
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--sweep", action="store_true")
     # evaluation settings
     parser.add_argument("--data_path", type=str, default="data/all.jsonl")
     parser.add_argument("--screenshots_dir", type=str, default="data/screenshots")
+    parser.add_argument("--image_max_size", type=int, default=None)
+    parser.add_argument("--image_format", type=str, default="png", choices=["png", "palette", "jpeg", "webp"])
+    parser.add_argument("--image_quality", type=int, default=85)
     parser.add_argument("--output_dir", type=str, default="outputs")
     parser.add_argument("--model", type=str, default="gpt-4.1")
+    parser.add_argument("--use_async", action="store_true")
+    parser.add_argument("--max_concurrency", type=int, default=512)
+    parser.add_argument("--prefix_cache", action="store_true")
+    parser.add_argument("--joint_single", action="store_true")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--stream_stop_early", action="store_true")
+    # batch mode
+    parser.add_argument("--batch", action="store_true")
+    parser.add_argument("--batch_backend", type=str, default="openai", choices=["openai", "local"])
+    parser.add_argument("--batch_poll_interval", type=int, default=60)
+    # response cache
+    parser.add_argument("--no_cache", action="store_true")
+    parser.add_argument("--cache_path", type=str, default="cache/responses.sqlite")
+    parser.add_argument("--cache_max_size_mb", type=int, default=2048)
     # for rubric
     parser.add_argument("--rubric_type", type=str, default="combined", choices=["combined", "static", "dynamic", "intention"])
     parser.add_argument("--rubric_path", type=str, default="data/rubric.jsonl")
+    # for --sweep: thresholds on the score difference, and per-branch weights of combined rubrics
+    parser.add_argument("--thresholds", type=float, nargs="+", default=None)
+    parser.add_argument("--weight_values", type=float, nargs="+", default=[0, 0.5, 1, 2])
     return parser.parse_args()
 
 
+def run_sweep(args):
+    if args.setting == "likert":
+        likert_sweep(args, args.thresholds or [0, 0.5, 1, 1.5, 2, 3, 4])
+    elif args.setting == "rubric":
+        weight_grid = [dict(zip(["intention", "static", "dynamic"], values))
+                       for values in itertools.product(args.weight_values, repeat=3) if any(values)]
+        rubric_sweep(args, weight_grid, args.thresholds or [0])
+    else:
+        raise NotImplementedError
+
+
 def run_exp(args):
-    if args.eval:
+    if args.sweep:
+        run_sweep(args)
+    elif args.eval:
         if args.setting == "likert":
             likert_evaluate(args)
         elif args.setting == "rubric":
@@ -49,4 +90,7 @@ if __name__ == "__main__":
     args = parse_args()
     if not os.path.exists(args.output_dir):
         os.makedirs(args.output_dir)
+    cache.configure(path=args.cache_path, max_size_mb=args.cache_max_size_mb, enabled=not args.no_cache)
+    configure_images(max_size=args.image_max_size, image_format=args.image_format, quality=args.image_quality)
+    configure_stream(stop_early=args.stream_stop_early)
     run_exp(args)
\ No newline at end of file
@@ -2,12 +2,17 @@ import os
 import time
 import logging
 import argparse
+from urllib.parse import urlsplit
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import NoAlertPresentException, WebDriverException
 import pyautogui
 import json
 from evaluator.gui_agent import UITARS
+from utils.basic import configure_images
+from utils.task_queue import pending_tasks
 
 
 CHROME_DRIVER_PATH = "/usr/local/bin/chromedriver"
@@ -17,13 +22,6 @@ WINDOW_SIZE = (1920, 1080)
 INITIAL_WINDOW_POSITION = (0, 0)
 SCREEN_WIDTH, SCREEN_HEIGHT = pyautogui.size()
 
-costs = {
-    "prompt_token_count": 0,
-    "candidates_token_count": 0,
-    "thoughts_token_count": 0
-}
-codes = []
-
 def setup_logger(name="AutoWebAgent"):
     logger = logging.getLogger(name)
     if not logger.handlers:
@@ -42,36 +40,133 @@ def setup_logger(name="AutoWebAgent"):
 logger = setup_logger()
 
 
-def initialize_environment(webpage_path):
+CHROME_ARGUMENTS = [
+    '--no-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-gpu',
+    '--disable-web-security',
+    '--disable-extensions',
+    '--disable-plugins',
+    '--disable-background-timer-throttling',
+    '--disable-backgrounding-occluded-windows',
+    '--disable-renderer-backgrounding',
+    '--disable-features=TranslateUI',
+    '--disable-ipc-flooding-protection',
+    '--disable-default-apps',
+    '--disable-sync',
+    '--no-first-run',
+    '--no-default-browser-check',
+    '--disable-blink-features=AutomationControlled',
+]
+PAGE_LOAD_TIMEOUT = 30
+# time for client-side rendering after the document has loaded
+PAGE_SETTLE_SECONDS = 0.5
+
+
+def create_driver():
     chrome_options = Options()
     chrome_options.binary_location = "/opt/chrome-linux64/chrome"
-    chrome_options.add_argument('--no-sandbox')
-    chrome_options.add_argument('--disable-dev-shm-usage')
-    chrome_options.add_argument('--disable-gpu')
-    chrome_options.add_argument('--disable-web-security')
-    chrome_options.add_argument('--disable-extensions')
-    chrome_options.add_argument('--disable-plugins')
-    chrome_options.add_argument('--disable-background-timer-throttling')
-    chrome_options.add_argument('--disable-backgrounding-occluded-windows')
-    chrome_options.add_argument('--disable-renderer-backgrounding')
-    chrome_options.add_argument('--disable-features=TranslateUI')
-    chrome_options.add_argument('--disable-ipc-flooding-protection')
-    chrome_options.add_argument('--disable-default-apps')
-    chrome_options.add_argument('--disable-sync')
-    chrome_options.add_argument('--no-first-run')
-    chrome_options.add_argument('--no-default-browser-check')
-    chrome_options.add_argument('--disable-blink-features=AutomationControlled')
+    for argument in CHROME_ARGUMENTS:
+        chrome_options.add_argument(argument)
     chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
     chrome_options.add_experimental_option('useAutomationExtension', False)
 
     service = Service(executable_path=CHROME_DRIVER_PATH)
     driver = webdriver.Chrome(service=service, options=chrome_options)
-
-    driver.get(webpage_path)
-    driver.set_window_size(WINDOW_SIZE[0], WINDOW_SIZE[1])  # Set fixed size for consistency
-    time.sleep(2)
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
     return driver
 
+
+class BrowserSession:
+    """
+    One long-lived Chrome per display, reused across tasks. `open` resets the state a previous task
+    may have left behind (windows and tabs, alerts, cookies, HTTP cache, window size and position, and
+    everything the page's origin stored: local/session storage, IndexedDB, Cache Storage, service
+    workers) and loads the page, instead of starting a new browser for every task.
+    A browser that no longer responds is replaced.
+    """
+    def __init__(self):
+        self.driver = None
+
+    def _start(self):
+        logger.info("Starting browser...")
+        self.driver = create_driver()
+        # give the window manager time to map the new window before the first screenshot
+        time.sleep(2)
+
+    def _reset(self, webpage_path):
+        driver = self.driver
+        try:
+            driver.switch_to.alert.dismiss()
+        except NoAlertPresentException:
+            pass
+        # a fresh tab, since sessionStorage belongs to the tab
+        handles = driver.window_handles
+        driver.switch_to.new_window("tab")
+        tab = driver.current_window_handle
+        for handle in handles:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(tab)
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+        origin = urlsplit(webpage_path)
+        if origin.scheme in ("http", "https"):
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin", {
+                "origin": f"{origin.scheme}://{origin.netloc}",
+                "storageTypes": "all",
+            })
+        driver.set_window_position(*INITIAL_WINDOW_POSITION)
+        driver.set_window_size(WINDOW_SIZE[0], WINDOW_SIZE[1])  # Set fixed size for consistency
+
+    def _load(self, webpage_path):
+        self.driver.get(webpage_path)
+        WebDriverWait(self.driver, PAGE_LOAD_TIMEOUT).until(
+            lambda driver: driver.execute_script("return document.readyState") == "complete"
+        )
+
+    def open(self, webpage_path):
+        if self.driver is None:
+            self._start()
+        else:
+            try:
+                self._reset(webpage_path)
+            except WebDriverException as e:
+                logger.warning(f"Browser did not respond, restarting it: {e}")
+                self.close()
+                self._start()
+        self._load(webpage_path)
+        self.driver.set_window_position(*INITIAL_WINDOW_POSITION)
+        self.driver.set_window_size(WINDOW_SIZE[0], WINDOW_SIZE[1])
+        time.sleep(PAGE_SETTLE_SECONDS)
+        return self.driver
+
+    def close(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except WebDriverException:
+                pass
+            self.driver = None
+
+
+_sessions = {}
+
+
+def get_browser_session():
+    """The browser session of the current display (one per display, created on first use)."""
+    display = os.environ.get("DISPLAY", "")
+    if display not in _sessions:
+        _sessions[display] = BrowserSession()
+    return _sessions[display]
+
+
+def close_browser_sessions():
+    for session in _sessions.values():
+        session.close()
+    _sessions.clear()
+
+
 def capture_screenshot(screenshot_count, screenshot_dir):
     filename = f"screenshot_{screenshot_count:03d}.png"
     filepath = os.path.join(screenshot_dir, filename)
@@ -86,12 +181,26 @@ def capture_screenshot(screenshot_count, screenshot_dir):
     return filepath, image_width, image_height
 
 
-def workflow(base_dir, instruction, host_url, task_type, max_steps):
+def workflow(base_dir, instruction, host_url, task_type, max_steps, session=None):
+    """
+    Run one task. With a BrowserSession, its browser is reset and reused (and left open for the next
+    task); without one, a browser is started for this task only.
+    """
+    # token usage and actions of this task only
+    costs = {
+        "prompt_token_count": 0,
+        "candidates_token_count": 0,
+        "thoughts_token_count": 0
+    }
+    codes = []
+    own_session = session is None
+    if own_session:
+        session = BrowserSession()
+    messages_path = os.path.join(base_dir, "messages.json")
     try:
-        messages_path = os.path.join(base_dir, "messages.json")
         screenshot_dir = os.path.join(base_dir, "screenshots")
         logger.info("Initializing environment...")
-        driver = initialize_environment(host_url)
+        session.open(host_url)
         logger.info("Environment initialized successfully")
         
         screenshot_count = 1
@@ -137,7 +246,6 @@ def workflow(base_dir, instruction, host_url, task_type, max_steps):
                 with open(messages_path, "w") as f:
                     json.dump({"final_result": "MAX ROUNDS", "error_message": "reach the max number of screenshots", "costs": costs, "trajectory": messages, "codes": codes}, f, indent=4, ensure_ascii=False)
                 break
-        driver.quit()
         logger.info("Workflow finished")
         
     except Exception as e:
@@ -145,23 +253,13 @@ def workflow(base_dir, instruction, host_url, task_type, max_steps):
         logger.error(f"Error message: {str(e)}")
         with open(messages_path, "w") as f:
             json.dump({"final_result": "INITIAL_ERROR", "error_message": str(e), "costs": costs, "trajectory": None, "codes": codes}, f, indent=4, ensure_ascii=False)
-        exit(0)
+    finally:
+        if own_session:
+            session.close()
 
-if __name__ == "__main__":
-    # safe measures
-    pyautogui.PAUSE = 1.0  # pause 1 second after each pyautogui operation
-    pyautogui.FAILSAFE = True  # enable fail safe
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--base_dir", type=str, default="data/unit_test")
-    parser.add_argument("--host", type=str, default="localhost")
-    parser.add_argument("--port", type=str, default="3000")
-    parser.add_argument("--webdev_unit", action="store_true")
-    args = parser.parse_args()
-    base_dir = args.base_dir
-    host_url = f"http://{args.host}:{args.port}"
-    if args.webdev_unit:
-        host_url = f"file://{os.path.join(os.path.dirname(base_dir), 'web.html')}"
-    
+
+def run_task(base_dir, host_url, session=None):
+    """Run the task in base_dir (its metadata.json) against the page at host_url."""
     with open(os.path.join(base_dir, "metadata.json"), "r") as f:
         metadata = json.load(f)
     instruction = metadata["instruction"]
@@ -178,4 +276,54 @@ if __name__ == "__main__":
     logger.info(f"messages will be saved to: {os.path.join(base_dir, 'messages.json')}")
     logger.info(f"screenshots will be saved to: {os.path.join(base_dir, 'screenshots')}")
     logger.info("="*50)
-    workflow(base_dir, instruction, host_url, task_type, max_steps + 1)
\ No newline at end of file
+    workflow(base_dir, instruction, host_url, task_type, max_steps + 1, session)
+
+
+def task_host_url(task_dir, host, port, webdev_unit=False):
+    if webdev_unit:
+        return f"file://{os.path.join(os.path.dirname(task_dir), 'web.html')}"
+    return f"http://{host}:{port}"
+
+
+def run_tasks_file(tasks_file, host, port, webdev_unit=False, rerun_all=False):
+    """
+    Run the tasks listed in a tasks.txt in this process, reusing the display's browser session. Tasks
+    whose messages.json already has a terminal final_result are skipped unless rerun_all is set.
+    """
+    task_dirs = pending_tasks(tasks_file, rerun_all)
+    if not task_dirs:
+        logger.info(f"All tasks of {tasks_file} have finished, skipping...")
+        return
+    session = get_browser_session()
+    for task_dir in task_dirs:
+        logger.info(f"--- Processing task: {task_dir} ---")
+        try:
+            run_task(task_dir, task_host_url(task_dir, host, port, webdev_unit), session)
+        except Exception as e:
+            logger.error(f"Task failed: {task_dir}: {e}")
+
+
+if __name__ == "__main__":
+    # safe measures
+    pyautogui.PAUSE = 1.0  # pause 1 second after each pyautogui operation
+    pyautogui.FAILSAFE = True  # enable fail safe
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base_dir", type=str, default="data/unit_test")
+    # run all tasks of a tasks.txt in this process with one browser, instead of a single --base_dir
+    parser.add_argument("--tasks_file", type=str, default=None)
+    parser.add_argument("--rerun_all", action="store_true")
+    parser.add_argument("--host", type=str, default="localhost")
+    parser.add_argument("--port", type=str, default="3000")
+    parser.add_argument("--webdev_unit", action="store_true")
+    parser.add_argument("--image_max_size", type=int, default=None)
+    parser.add_argument("--image_format", type=str, default="png", choices=["png", "palette", "jpeg", "webp"])
+    parser.add_argument("--image_quality", type=int, default=85)
+    args = parser.parse_args()
+    configure_images(max_size=args.image_max_size, image_format=args.image_format, quality=args.image_quality)
+    if args.tasks_file is not None:
+        try:
+            run_tasks_file(args.tasks_file, args.host, args.port, args.webdev_unit, args.rerun_all)
+        finally:
+            close_browser_sessions()
+    else:
+        run_task(args.base_dir, task_host_url(args.base_dir, args.host, args.port, args.webdev_unit))
@@ -56,9 +56,9 @@ if [ ! -f "webs.txt" ]; then
     echo "Error: webs.txt not found"
     exit 1
 fi
-if [ ! -x "run_serial.sh" ]; then
-    echo "Making run_serial.sh executable..."
-    chmod +x run_serial.sh
+if [ ! -f "gui_runner.py" ]; then
+    echo "Error: gui_runner.py not found"
+    exit 1
 fi
 
 # Create log directory.
@@ -72,51 +72,55 @@ if [ -z "$DATASET_END" ] || [ "$DATASET_END" -gt "$TOTAL_LINES" ]; then
 fi
 TOTAL_TASKS=$((DATASET_END - DATASET_START + 1))
 if [ "$TOTAL_TASKS" -lt "$NUM_CHUNKS" ]; then
-    echo "Warning: More chunks than tasks, reducing chunks to $TOTAL_TASKS"
+    echo "Warning: More workers than web pages, reducing workers to $TOTAL_TASKS"
     NUM_CHUNKS=$TOTAL_TASKS
 fi
 
-# Calculate chunk size.
-CHUNK_SIZE=$(( (TOTAL_TASKS + NUM_CHUNKS - 1) / NUM_CHUNKS ))
+# All workers pull web pages from one shared queue, the most expensive ones (by the summed max_steps of
+# their tasks) first, so that no worker is left with a long tail of heavy pages.
+QUEUE_PATH="$LOG_DIR/queue.sqlite"
+rm -f "$QUEUE_PATH" "$QUEUE_PATH-wal" "$QUEUE_PATH-shm"
+# Pages pre-built with gui_build.py are served statically; the others fall back to each worker's dev server.
+STATIC_ARGS=()
+if [ -f "static_pages/manifest.json" ]; then
+    STATIC_ARGS=(--static_dir static_pages)
+    echo "Pre-built pages: static_pages/"
+fi
 echo "Dataset range: lines $DATASET_START-$DATASET_END"
-echo "Total tasks to process: $TOTAL_TASKS"
-echo "Number of chunks: $NUM_CHUNKS"
-echo "Tasks per chunk: $CHUNK_SIZE"
+echo "Total web pages to process: $TOTAL_TASKS"
+echo "Number of workers: $NUM_CHUNKS"
+echo "Shared queue: $QUEUE_PATH"
 echo "Logs will be saved to: $LOG_DIR/"
 
 PIDS=()
 
-# Launch parallel jobs.
+# Launch parallel workers.
 for ((chunk=0; chunk<NUM_CHUNKS; chunk++)); do
-    CHUNK_START_OFFSET=$((chunk * CHUNK_SIZE))
-    CHUNK_END_OFFSET=$((CHUNK_START_OFFSET + CHUNK_SIZE - 1))
-    if [ $CHUNK_END_OFFSET -ge $TOTAL_TASKS ]; then
-        CHUNK_END_OFFSET=$((TOTAL_TASKS - 1))
-    fi
-    
-    START_LINE=$((DATASET_START + CHUNK_START_OFFSET))
-    END_LINE=$((DATASET_START + CHUNK_END_OFFSET))
-    
     DISPLAY_NUM=$((START_DISPLAY + chunk))
     LOG_FILE="$LOG_DIR/chunk_${chunk}_display_${DISPLAY_NUM}.log"
-    
-    echo "Starting chunk $((chunk + 1))/$NUM_CHUNKS (lines $START_LINE-$END_LINE) on display :$DISPLAY_NUM with worker ID $chunk"
+    NEXTJS_WORKSPACE="workspace/workspace_${chunk}"
+    if [ ! -d "$NEXTJS_WORKSPACE" ]; then
+        echo "Error: Next.js workspace '$NEXTJS_WORKSPACE' not found, skipping worker $chunk."
+        continue
+    fi
+
+    echo "Starting worker $((chunk + 1))/$NUM_CHUNKS on display :$DISPLAY_NUM with worker ID $chunk"
     echo "Log file: $LOG_FILE"
-    
-    # Run the serial script for Next.js in the background.
-    ./run_serial.sh $DISPLAY_NUM $START_LINE $END_LINE $chunk > "$LOG_FILE" 2>&1 &
+
+    # Run the worker in the background.
+    python3 gui_runner.py --display_num $DISPLAY_NUM --start_line $DATASET_START --end_line $DATASET_END --worker_id $chunk --queue "$QUEUE_PATH" "${STATIC_ARGS[@]}" > "$LOG_FILE" 2>&1 &
     PIDS+=($!)
 done
 
 # Wait for all jobs to complete.
-echo "Waiting for all chunks to complete..."
+echo "Waiting for all workers to complete..."
 for pid in "${PIDS[@]}"; do
     wait $pid
     status=$?
     if [ $status -ne 0 ]; then
-        echo "Warning: A chunk process (PID: $pid) exited with status $status"
+        echo "Warning: A worker process (PID: $pid) exited with status $status"
     fi
 done
 
-echo "All chunks have completed."
+echo "All workers have completed."
 echo "Check individual logs in: $LOG_DIR/" 
\ No newline at end of file
@@ -70,22 +70,14 @@ for ((i=START_LINE; i<=END_LINE; i++)); do
     fi
 
     echo "Processing tasks from $tasks_file_path"
-    while IFS= read -r task_dir; do
-        if [ -z "$task_dir" ]; then
-            echo "Warning: Empty line in $tasks_file_path, skipping..."
-            continue
-        fi
-
-        echo "--- Processing task: $task_dir ---"
-        python3 run_gui_agent.py --base_dir "$task_dir" --webdev_unit
-
-        # Check the exit status of the agent.
-        if [ $? -ne 0 ]; then
-            echo "Process task: $task_dir with error"
-        else
-            echo "Task completed successfully: $task_dir"
-        fi
-    done < "$tasks_file_path"
+    python3 run_gui_agent.py --tasks_file "$tasks_file_path" --webdev_unit
+
+    # Check the exit status of the agent.
+    if [ $? -ne 0 ]; then
+        echo "Process tasks: $tasks_file_path with error"
+    else
+        echo "Tasks completed: $tasks_file_path"
+    fi
 
     # Pause between web directories.
     if [ $i -lt $END_LINE ]; then
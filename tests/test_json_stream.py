@@ -0,0 +1,42 @@
+from utils.basic import extract_and_parse_json
+from utils.json_stream import JsonStreamScanner, COMPLETE, MALFORMED
+
+DRAFT_THEN_FINAL = """Let me sketch the format first:
+```json
+{"1.1": 1, "note": "draft with a } in a string"}
+```
+Now the actual scores.
+```json
+{"1.1": 5, "1.2": [4, 3]}
+```"""
+
+
+def scan(text, chunk_size):
+    scanner = JsonStreamScanner()
+    for i in range(0, len(text), chunk_size):
+        scanner.feed(text[i:i + chunk_size])
+    return scanner
+
+
+def test_two_fenced_blocks_match_non_streaming_parse():
+    for chunk_size in [1, 2, 3, 7, len(DRAFT_THEN_FINAL)]:
+        scanner = scan(DRAFT_THEN_FINAL, chunk_size)
+        assert scanner.state == COMPLETE
+        assert scanner.text == DRAFT_THEN_FINAL
+        assert extract_and_parse_json(scanner.text) == {"1.1": 5, "1.2": [4, 3]}
+
+
+def test_state_follows_the_last_block():
+    assert scan("```json\n{\"a\": 1}\n```\n```json\nnot json\n```", 1).state == MALFORMED
+    assert scan("```json\n{\"a\": 1]\n```\n```json\n{\"a\": 2}\n```", 1).state == COMPLETE
+    assert scan("```json\n{\"a\": ```json\n{\"a\": 2}\n```", 1).state == COMPLETE
+
+
+def test_closed_once_the_fence_follows_the_object():
+    for chunk_size in [1, 2, 3, 7, 100]:
+        assert scan("Scores:\n```json\n{\"a\": 1}\n```\nThat is all.", chunk_size).closed
+        # text before the fence, or a new block right after, means the block is not the final one yet
+        assert not scan("```json\n{\"a\": 1} wait\n```\n", chunk_size).closed
+        assert not scan("```json\n{\"a\": 1}\n```json\n{\"a\": 2", chunk_size).closed
+        assert not scan(DRAFT_THEN_FINAL, chunk_size).closed
+    assert scan(DRAFT_THEN_FINAL + "\n", 1).closed
@@ -1,19 +1,186 @@
+import os
+import io
 import base64
-import re
 import json
+from functools import lru_cache
 
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        image = base64.b64encode(image_file.read()).decode('utf-8')
-    return image
+# Optional preprocessing of images before they are inlined into prompts, set with configure_images().
+# The defaults send the original PNG unchanged.
+IMAGE_OPTIONS = {"max_size": None, "format": "png", "quality": 85}
+IMAGE_FORMATS = {"png": "image/png", "palette": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+
+def configure_images(max_size=None, image_format="png", quality=85):
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Invalid image format: {image_format}")
+    IMAGE_OPTIONS.update({"max_size": max_size, "format": image_format, "quality": quality})
+
+
+def _image_options():
+    """Hashable form of IMAGE_OPTIONS, or None when images are sent unchanged."""
+    if IMAGE_OPTIONS["max_size"] is None and IMAGE_OPTIONS["format"] == "png":
+        return None
+    return (IMAGE_OPTIONS["max_size"], IMAGE_OPTIONS["format"], IMAGE_OPTIONS["quality"])
+
+
+def image_to_data_url(image_path):
+    """
+    Data URL of the image after the preprocessing configured with configure_images(). The base64 is
+    memoized on (path, mtime, size, options) so repeated prompts for the same screenshot do not re-read
+    and re-encode it; an up-to-date precomputed store file (see image_store_path) is used if present.
+    """
+    options = _image_options()
+    stat = os.stat(image_path)
+    image = _encode_image(image_path, stat.st_mtime_ns, stat.st_size, options)
+    mime_type = IMAGE_FORMATS[options[1]] if options is not None else "image/png"
+    return f"data:{mime_type};base64,{image}"
+
+
+@lru_cache(maxsize=128)
+def _encode_image(image_path, mtime_ns, size, options):
+    store_path = image_store_path(image_path, options)
+    if os.path.exists(store_path) and os.stat(store_path).st_mtime_ns >= mtime_ns:
+        with open(store_path, "r") as f:
+            return f.read()
+    return base64.b64encode(_read_image(image_path, options)).decode('utf-8')
+
+
+def _read_image(image_path, options):
+    if options is None:
+        with open(image_path, "rb") as image_file:
+            return image_file.read()
+    return transform_image(image_path, *options)
+
+
+def transform_image(image_path, max_size=None, image_format="png", quality=85):
+    """Downscale the image so its longer side is at most max_size and re-encode it; returns the bytes."""
+    from PIL import Image
+    with Image.open(image_path) as image:
+        image.load()
+    if max_size is not None and max(image.size) > max_size:
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    if image_format == "jpeg":
+        image.convert("RGB").save(buffer, "JPEG", quality=quality, optimize=True)
+    elif image_format == "webp":
+        image.save(buffer, "WEBP", quality=quality)
+    elif image_format == "palette":
+        image.convert("RGB").quantize(colors=256).save(buffer, "PNG", optimize=True)
+    else:
+        image.save(buffer, "PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def image_store_path(image_path, options=None):
+    if options is None:
+        return image_path + ".b64"
+    max_size, image_format, quality = options
+    return f"{image_path}.{max_size or 'full'}_{image_format}_{quality}.b64"
+
+
+def precompute_image_store(image_dir):
+    """
+    Write the base64 of every png in image_dir, after the configured preprocessing, next to the image
+    (skipping stores that are newer than their image).
+    """
+    options = _image_options()
+    count = 0
+    for name in sorted(os.listdir(image_dir)):
+        if not name.endswith(".png"):
+            continue
+        image_path = os.path.join(image_dir, name)
+        store_path = image_store_path(image_path, options)
+        if os.path.exists(store_path) and os.stat(store_path).st_mtime_ns >= os.stat(image_path).st_mtime_ns:
+            continue
+        image = base64.b64encode(_read_image(image_path, options)).decode('utf-8')
+        with open(store_path, "w") as f:
+            f.write(image)
+        count += 1
+    return count
 
 
 def extract_and_parse_json(response_str):
-    matches = re.findall(r'```json(.*?)```', response_str, re.DOTALL)
-    if matches:
-        extracted_json = matches[-1].strip()
+    """
+    Parse the json object a judge ends its output with: the last ```json block (read to the end of the
+    response if its fence is not closed), or else the last bare top-level {...} object. Unescaped
+    newlines/tabs in strings and trailing commas are tolerated. Raises ValueError if there is none.
+    """
+    start = response_str.rfind("```json")
+    if start >= 0:
+        start += len("```json")
+        end = response_str.find("```", start)
+        extracted_json = response_str[start:end if end >= 0 else len(response_str)].strip()
+    else:
+        extracted_json = _last_bare_object(response_str)
+        if extracted_json is None:
+            raise ValueError("No JSON found in response")
+    try:
         return json.loads(extracted_json)
-    raise ValueError("No JSON found in response")
+    except json.JSONDecodeError:
+        # strict=False accepts control characters (raw newlines) inside strings
+        return json.loads(_strip_trailing_commas(extracted_json), strict=False)
+
+
+def try_parse_json(response_str):
+    """extract_and_parse_json, or None if the response is missing or has no parsable json."""
+    if response_str is None:
+        return None
+    try:
+        return extract_and_parse_json(response_str)
+    except ValueError:
+        return None
+
+
+def _last_bare_object(text):
+    """The last balanced top-level {...} of the text, found in one pass; None if there is none."""
+    last = None
+    depth = 0
+    start = 0
+    in_string = escape = False
+    for i, char in enumerate(text):
+        if depth == 0:
+            if char == "{":
+                depth, start = 1, i
+            continue
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                last = text[start:i + 1]
+    return last
 
 
+def _strip_trailing_commas(text):
+    """Remove commas that are followed (after whitespace) by a closing bracket, outside of strings."""
+    out = []
+    pending_comma = None
+    in_string = escape = False
+    for char in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        if pending_comma is not None and not char.isspace():
+            if char in "}]" and not in_string:
+                out[pending_comma] = ""
+            pending_comma = None
+        if char == "," and not in_string:
+            pending_comma = len(out)
+        out.append(char)
+    return "".join(out)
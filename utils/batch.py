@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import uuid
+from utils.get_response import get_client, generate, _create_kwargs
+
+# provider limits of a single batch input file
+MAX_BATCH_REQUESTS = 50000
+MAX_BATCH_BYTES = 190 * 1024 * 1024
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def write_batch_inputs(requests, batch_dir, max_requests=MAX_BATCH_REQUESTS, max_bytes=MAX_BATCH_BYTES):
+    """
+    Write (custom_id, model, messages, generation_config) requests to batch-input JSONL files in the
+    chat-completions batch format, starting a new file whenever the request or size limit is reached.
+    Returns the paths of the written files.
+    """
+    os.makedirs(batch_dir, exist_ok=True)
+    paths = []
+    f = None
+    count = size = 0
+    for custom_id, model, messages, generation_config in requests:
+        line = json.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": _create_kwargs(model, messages, generation_config),
+        }, ensure_ascii=False) + "\n"
+        line_size = len(line.encode("utf-8"))
+        if f is None or count >= max_requests or size + line_size > max_bytes:
+            if f is not None:
+                f.close()
+            paths.append(os.path.join(batch_dir, f"input_{len(paths):03d}.jsonl"))
+            f = open(paths[-1], "w")
+            count = size = 0
+        f.write(line)
+        count += 1
+        size += line_size
+    if f is not None:
+        f.close()
+    return paths
+
+
+class OpenAIBatchBackend:
+    """Submits batch-input files to the provider's Batch API of a config entry."""
+    def __init__(self, model):
+        self.client = get_client(model)
+
+    def submit(self, input_path):
+        with open(input_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=input_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+        return batch.id
+
+    def status(self, batch_id):
+        return self.client.batches.retrieve(batch_id).status
+
+    def download(self, batch_id, output_path):
+        batch = self.client.batches.retrieve(batch_id)
+        with open(output_path, "wb") as f:
+            for file_id in [batch.output_file_id, batch.error_file_id]:
+                if file_id is not None:
+                    f.write(self.client.files.content(file_id).read())
+
+
+class LocalBatchBackend:
+    """
+    File-based stand-in for the Batch API, for testing the batch pipeline: `submit` runs every request
+    of the input file through generate() (so the response cache and rate limiter apply) and writes the
+    results in the batch output format into the batch directory.
+    """
+    def __init__(self, model):
+        self.model = model
+
+    def submit(self, input_path):
+        batch_id = f"local_{uuid.uuid4().hex}"
+        output_path = os.path.join(os.path.dirname(input_path), f"{batch_id}.jsonl")
+        with open(input_path, "r") as f_in, open(output_path, "w") as f_out:
+            for line in f_in:
+                request = json.loads(line)
+                body = request["body"]
+                generation_config = {"max_tokens": body["max_tokens"], "temperature": body["temperature"]}
+                try:
+                    response, metadata = generate(model=self.model, messages=body["messages"], generation_config=generation_config)
+                    result = {"status_code": 200, "body": {
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": response}}],
+                        "usage": {
+                            "prompt_tokens": metadata["prompt_token_count"],
+                            "completion_tokens": metadata["candidates_token_count"],
+                            "prompt_tokens_details": {"cached_tokens": metadata.get("cached_token_count", 0)},
+                        },
+                    }}
+                    error = None
+                except Exception as e:
+                    result, error = None, {"message": str(e)}
+                f_out.write(json.dumps({"id": uuid.uuid4().hex, "custom_id": request["custom_id"], "response": result, "error": error}) + "\n")
+        return batch_id
+
+    def status(self, batch_id):
+        return "completed"
+
+    def download(self, batch_id, output_path):
+        os.replace(os.path.join(os.path.dirname(output_path), f"{batch_id}.jsonl"), output_path)
+
+
+BACKENDS = {"openai": OpenAIBatchBackend, "local": LocalBatchBackend}
+
+
+def batch_custom_id(item):
+    """question_id for pairwise items, question_id::side for single ones."""
+    return f"{item['question_id']}::{item['model']}" if "model" in item else item["question_id"]
+
+
+def batch_item(custom_id):
+    """The key fields of the item a custom_id was built from (see batch_custom_id)."""
+    if "::" in custom_id:
+        question_id, model = custom_id.rsplit("::", 1)
+        return {"question_id": question_id, "model": model}
+    return {"question_id": custom_id}
+
+
+def parse_batch_output(path):
+    """Yield (custom_id, response, metadata) for every line of a batch output file; response is None on errors."""
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response")
+            if record.get("error") or response is None or response.get("status_code") != 200:
+                print(f"Batch request {record['custom_id']} failed: {record.get('error') or (response or {}).get('body')}")
+                yield record["custom_id"], None, None
+                continue
+            body = response["body"]
+            usage = body.get("usage") or {}
+            metadata = {
+                "prompt_token_count": usage.get("prompt_tokens", 0),
+                "candidates_token_count": usage.get("completion_tokens", 0),
+                "thoughts_token_count": 0,
+                "cached_token_count": (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0,
+                "batch_id": record.get("id"),
+            }
+            yield record["custom_id"], body["choices"][0]["message"]["content"], metadata
+
+
+def _save_state(state_path, state):
+    with open(state_path, "w") as f:
+        json.dump(state, f, indent=4)
+
+
+def run_batch(requests, batch_dir, model, backend="openai", poll_interval=60):
+    """
+    Write the requests to batch-input files under batch_dir, submit them, poll until every batch has
+    finished and yield (custom_id, response, metadata) from the outputs. The batches are tracked in
+    batch_dir/state.json, so an interrupted run resumes submitting/polling instead of starting over;
+    remove batch_dir to build and submit the requests again.
+    """
+    backend = BACKENDS[backend](model)
+    state_path = os.path.join(batch_dir, "state.json")
+    if os.path.exists(state_path):
+        with open(state_path, "r") as f:
+            state = json.load(f)
+        print(f"Resuming {len(state['batches'])} batches from {state_path}")
+    else:
+        input_paths = write_batch_inputs(requests, batch_dir)
+        state = {"batches": [{"input": input_path, "id": None, "status": None} for input_path in input_paths]}
+        _save_state(state_path, state)
+    for batch in state["batches"]:
+        if batch["id"] is None:
+            batch["id"], batch["status"] = backend.submit(batch["input"]), "submitted"
+            _save_state(state_path, state)
+            print(f"Submitted batch {batch['id']} ({batch['input']})")
+
+    while True:
+        for batch in state["batches"]:
+            if batch["status"] not in TERMINAL_STATUSES:
+                batch["status"] = backend.status(batch["id"])
+        _save_state(state_path, state)
+        pending = [batch for batch in state["batches"] if batch["status"] not in TERMINAL_STATUSES]
+        if not pending:
+            break
+        print(f"{len(pending)} batches pending, checking again in {poll_interval}s")
+        time.sleep(poll_interval)
+
+    for batch in state["batches"]:
+        if batch["status"] != "completed":
+            print(f"Batch {batch['id']} ended with status {batch['status']}")
+        output_path = batch["input"].replace("input_", "output_")
+        if not os.path.exists(output_path):
+            backend.download(batch["id"], output_path)
+        yield from parse_batch_output(output_path)
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+DEFAULT_CACHE_PATH = "cache/responses.sqlite"
+DEFAULT_MAX_SIZE_MB = 2048
+
+
+class ResponseCache:
+    """
+    Persistent SQLite cache of model responses, keyed by a content hash of the request.
+    Entries are evicted least-recently-used first once the stored responses exceed `max_size` bytes.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_size=DEFAULT_MAX_SIZE_MB * 1024 * 1024):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT, metadata TEXT, size INTEGER, last_access REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.total_size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT response, metadata FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return row[0], json.loads(row[1])
+
+    def put(self, key, response, metadata):
+        if response is None:
+            return
+        metadata = json.dumps(metadata)
+        size = len(response.encode("utf-8")) + len(metadata)
+        with self.lock:
+            row = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.total_size -= row[0]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, metadata, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, response, metadata, size, time.time())
+            )
+            self.total_size += size
+            if self.total_size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        # drop the least recently used entries until we are back under 90% of the limit
+        target = self.max_size * 0.9
+        keys = []
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC"):
+            if self.total_size <= target:
+                break
+            keys.append((key,))
+            self.total_size -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+
+
+_cache = None
+_cache_path = DEFAULT_CACHE_PATH
+_cache_max_size = DEFAULT_MAX_SIZE_MB * 1024 * 1024
+_cache_enabled = True
+_cache_lock = threading.Lock()
+
+
+def configure(path=DEFAULT_CACHE_PATH, max_size_mb=DEFAULT_MAX_SIZE_MB, enabled=True):
+    """Set the process-wide cache location and size limit, or disable it with enabled=False."""
+    global _cache, _cache_path, _cache_max_size, _cache_enabled
+    with _cache_lock:
+        _cache = None
+        _cache_path = path
+        _cache_max_size = max_size_mb * 1024 * 1024
+        _cache_enabled = enabled
+
+
+def get_cache():
+    """Return the process-wide ResponseCache, or None if caching is disabled."""
+    global _cache
+    if not _cache_enabled:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(_cache_path, _cache_max_size)
+    return _cache
+
+
+def make_key(endpoint, messages, generation_config):
+    """
+    Hash of the endpoint (config entry, model name and base_url, so entries that serve the same model
+    name from different providers do not share responses), messages (including inlined base64 images)
+    and generation config.
+    """
+    payload = json.dumps([endpoint, messages, generation_config], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
@@ -0,0 +1,137 @@
+import os
+import json
+
+
+def iter_records(path):
+    """Stream the records of a JSONL file one at a time."""
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_spans(path):
+    """Stream [byte offset, length] and the parsed record of every non-empty line of a JSONL file."""
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield [offset, len(line)], json.loads(line)
+            offset += len(line)
+
+
+def count_records(path):
+    """Number of non-empty lines, without parsing them (for progress bars)."""
+    index = read_index(path)
+    if index is not None:
+        return len(index)
+    count = 0
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                count += 1
+    return count
+
+
+def index_path(path):
+    return os.path.splitext(path)[0] + ".index.json"
+
+
+def build_index(path):
+    """
+    Write `<name>.index.json` next to a JSONL dataset: question_id -> [byte offset, length, label],
+    stamped with the size and mtime of the dataset so that a stale index is detected and rebuilt.
+    """
+    records = {}
+    for span, record in iter_spans(path):
+        records[record["question_id"]] = span + [record.get("label")]
+    stat = os.stat(path)
+    with open(index_path(path), "w") as f:
+        json.dump({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "records": records}, f)
+    return records
+
+
+def read_index(path):
+    """The index of a JSONL dataset (see build_index) if it exists and is up to date, else None."""
+    if not os.path.exists(index_path(path)):
+        return None
+    with open(index_path(path), "r") as f:
+        index = json.load(f)
+    stat = os.stat(path)
+    # indexes written in the labels-only format have no "records" and count as stale
+    if "records" in index and index["size"] == stat.st_size and index["mtime_ns"] == stat.st_mtime_ns:
+        return index["records"]
+    return None
+
+
+def load_index(path):
+    """question_id -> [offset, length, label] for a JSONL dataset, (re)building the index if needed."""
+    index = read_index(path)
+    return index if index is not None else build_index(path)
+
+
+class RecordStore:
+    """
+    Records of a JSONL file by question_id, read on access by seeking to their [offset, length] span
+    instead of parsing the whole file. With `field`, only that field of a record is returned.
+    """
+    def __init__(self, path, spans=None, field=None):
+        self.path = path
+        self.spans = spans if spans is not None else load_index(path)
+        self.field = field
+
+    def __contains__(self, question_id):
+        return question_id in self.spans
+
+    def __len__(self):
+        return len(self.spans)
+
+    def __iter__(self):
+        return iter(self.spans)
+
+    def __getitem__(self, question_id):
+        offset, length = self.spans[question_id][:2]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            record = json.loads(f.read(length))
+        return record[self.field] if self.field else record
+
+
+def get_user_query(record):
+    return " ".join([i['content'][0]["text"] for i in record['conversation_a'] if i['role'] == 'user'])
+
+
+def get_code(record, model):
+    return record[f"conversation_{model}"][-1]['object']['code']
+
+
+def project_record(record):
+    """Keep only the fields used downstream from a data/all.jsonl record, dropping the full conversations."""
+    return {
+        "question_id": record["question_id"],
+        "model_a": record.get("model_a"),
+        "model_b": record.get("model_b"),
+        "user_query": get_user_query(record),
+        "code_a": get_code(record, "a"),
+        "code_b": get_code(record, "b"),
+        "label": record.get("label"),
+    }
+
+
+def iter_questions(path, question_ids=None):
+    """
+    Stream projected records of data/all.jsonl (see project_record), only those of question_ids if
+    given, which are looked up through the dataset index instead of parsing the other records.
+    """
+    if question_ids is None:
+        for record in iter_records(path):
+            yield project_record(record)
+        return
+    store = RecordStore(path)
+    for question_id in question_ids:
+        yield project_record(store[question_id])
+
+
+def load_labels(path):
+    """question_id -> label, read from the dataset index instead of parsing every record."""
+    return {question_id: entry[2] for question_id, entry in load_index(path).items()}
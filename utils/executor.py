@@ -0,0 +1,58 @@
+import asyncio
+import threading
+import concurrent.futures
+from utils.get_response import close_async_clients
+
+
+class AsyncExecutor:
+    """
+    Drop-in alternative to concurrent.futures.ThreadPoolExecutor for coroutine functions.
+    A single event loop runs in a background thread and keeps up to `max_concurrency`
+    coroutines in flight. `submit` returns a concurrent.futures.Future, so results can be
+    consumed with concurrent.futures.as_completed exactly like the thread pool.
+    """
+    def __init__(self, max_concurrency=512):
+        self.max_concurrency = max_concurrency
+        self.loop = asyncio.new_event_loop()
+        self._semaphore = None
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    async def _run(self, fn, args, kwargs):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            return await fn(*args, **kwargs)
+
+    def submit(self, fn, *args, **kwargs):
+        return asyncio.run_coroutine_threadsafe(self._run(fn, args, kwargs), self.loop)
+
+    def shutdown(self):
+        asyncio.run_coroutine_threadsafe(close_async_clients(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        return False
+
+
+def iter_completed(executor, fn, items, *args, max_pending=1024):
+    """
+    Submit fn(item, *args) for each item of a (possibly lazy) iterable, keeping at most `max_pending`
+    futures outstanding, and yield futures as they complete. Unlike building a dict of futures for
+    the whole dataset up front, memory stays bounded by `max_pending`.
+    """
+    pending = set()
+    for item in items:
+        pending.add(executor.submit(fn, item, *args))
+        if len(pending) >= max_pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            yield from done
+    while pending:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        yield from done
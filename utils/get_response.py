@@ -1,22 +1,354 @@
 import json
-from openai import OpenAI
+import time
+import asyncio
+import threading
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient, RateLimitError
+from utils import cache
+from utils.basic import extract_and_parse_json
+from utils.json_stream import JsonStreamScanner, MALFORMED
+from utils.rate_limiter import RETRYABLE_ERRORS, DEFAULT_MAX_RETRIES, get_limiter, estimate_tokens, retry_delay
 
 
 config = json.load(open("api_keys/config.json"))
-def generate(model="gpt-4o", messages=None, generation_config={"max_tokens": 16384, "temperature": 0.0}):
-    client = OpenAI(
-        api_key=config[model]["api_key"],
-        base_url=config[model]["base_url"],
-    )
-    response = client.chat.completions.create(
-        model=config[model]["model"],
-        messages=messages,
-        max_tokens=generation_config["max_tokens"],
-        temperature=generation_config["temperature"]
-    )
-    metadata = {
-        "prompt_token_count": response.usage.prompt_tokens,
-        "candidates_token_count": response.usage.completion_tokens,
+
+# Connection pool size shared by all threads using the same config entry.
+# Can be overridden per entry with "max_connections" in api_keys/config.json.
+DEFAULT_MAX_CONNECTIONS = 128
+
+_clients = {}
+_clients_lock = threading.Lock()
+# async clients are bound to the event loop of utils.executor.AsyncExecutor
+_async_clients = {}
+
+
+def _pool_limits(model):
+    max_connections = config[model].get("max_connections", DEFAULT_MAX_CONNECTIONS)
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+
+def get_client(model):
+    """Return the process-wide OpenAI client for a config entry, creating it on first use."""
+    client = _clients.get(model)
+    if client is not None:
+        return client
+    with _clients_lock:
+        if model not in _clients:
+            _clients[model] = OpenAI(
+                api_key=config[model]["api_key"],
+                base_url=config[model]["base_url"],
+                http_client=DefaultHttpxClient(limits=_pool_limits(model)),
+                # retries are handled by generate() together with the rate limiter
+                max_retries=0,
+            )
+        return _clients[model]
+
+
+def get_async_client(model):
+    """Return the AsyncOpenAI client for a config entry. Must be called from the running event loop."""
+    if model not in _async_clients:
+        _async_clients[model] = AsyncOpenAI(
+            api_key=config[model]["api_key"],
+            base_url=config[model]["base_url"],
+            http_client=DefaultAsyncHttpxClient(limits=_pool_limits(model)),
+            max_retries=0,
+        )
+    return _async_clients[model]
+
+
+async def close_async_clients():
+    for client in _async_clients.values():
+        await client.close()
+    _async_clients.clear()
+
+
+def _usage_metadata(usage):
+    # prompt tokens served from the provider's prompt-prefix cache, when it reports them
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_token_count": usage.prompt_tokens,
+        "candidates_token_count": usage.completion_tokens,
         "thoughts_token_count": 0,
+        "cached_token_count": getattr(details, "cached_tokens", None) or 0,
     }
-    return response.choices[0].message.content, metadata
\ No newline at end of file
+
+
+TOKEN_KEYS = ["prompt_token_count", "candidates_token_count", "thoughts_token_count", "cached_token_count"]
+
+
+def add_usage(total_tokens, metadata):
+    """
+    Add the token counts of a response to the totals (only the keys the totals have). Responses served
+    from the response cache cost nothing; they are counted as cache_hits instead.
+    """
+    if metadata is None:
+        return
+    if metadata.get("cache_hit"):
+        total_tokens["cache_hits"] = total_tokens.get("cache_hits", 0) + 1
+        return
+    for key in TOKEN_KEYS:
+        if key in total_tokens:
+            total_tokens[key] += metadata.get(key, 0)
+
+
+def _parse_completion(response):
+    return response.choices[0].message.content, _usage_metadata(response.usage)
+
+
+def _cache_lookup(model, messages, generation_config, read_cache):
+    response_cache = cache.get_cache()
+    if response_cache is None:
+        return None, None
+    key = cache.make_key([model, config[model]["model"], config[model]["base_url"]], messages, generation_config)
+    hit = response_cache.get(key) if read_cache else None
+    if hit is not None:
+        response, metadata = hit
+        metadata["cache_hit"] = True
+        return key, (response, metadata)
+    return key, None
+
+
+def _cache_store(key, response, metadata):
+    if key is not None:
+        cache.get_cache().put(key, response, metadata)
+
+
+def _create_kwargs(model, messages, generation_config):
+    return {
+        "model": config[model]["model"],
+        "messages": messages,
+        "max_tokens": generation_config["max_tokens"],
+        "temperature": generation_config["temperature"],
+    }
+
+
+def _usage_tokens(response):
+    return response.usage.prompt_tokens + response.usage.completion_tokens
+
+
+def _request(model, limiter, estimated_tokens, request):
+    """
+    Call request() paced by the rate limiter, retrying with exponential backoff on rate limit, timeout,
+    connection and 5xx errors; returns its result or raises once the retries are used up.
+    """
+    max_retries = config[model].get("max_retries", DEFAULT_MAX_RETRIES)
+    for attempt in range(max_retries + 1):
+        time.sleep(limiter.acquire(estimated_tokens))
+        try:
+            return request()
+        except RETRYABLE_ERRORS as e:
+            if isinstance(e, RateLimitError):
+                limiter.on_rate_limit()
+            if attempt == max_retries:
+                raise
+            delay = retry_delay(e, attempt)
+            print(f"{type(e).__name__} from {model}, retrying in {delay:.1f}s ({attempt + 1}/{max_retries})")
+            time.sleep(delay)
+
+
+async def _arequest(model, limiter, estimated_tokens, request):
+    """_request for a coroutine function."""
+    max_retries = config[model].get("max_retries", DEFAULT_MAX_RETRIES)
+    for attempt in range(max_retries + 1):
+        await asyncio.sleep(limiter.acquire(estimated_tokens))
+        try:
+            return await request()
+        except RETRYABLE_ERRORS as e:
+            if isinstance(e, RateLimitError):
+                limiter.on_rate_limit()
+            if attempt == max_retries:
+                raise
+            delay = retry_delay(e, attempt)
+            print(f"{type(e).__name__} from {model}, retrying in {delay:.1f}s ({attempt + 1}/{max_retries})")
+            await asyncio.sleep(delay)
+
+
+def generate(model="gpt-4o", messages=None, generation_config={"max_tokens": 16384, "temperature": 0.0}, read_cache=True):
+    """
+    Responses are served from / written to the on-disk cache (see utils/cache.py) unless it is disabled.
+    With read_cache=False the cache is not consulted but the fresh response still replaces the cached one.
+    Requests are paced by the per-model rate limiter (see utils/rate_limiter.py) and retried with
+    exponential backoff on rate limit, timeout, connection and 5xx errors.
+    """
+    key, hit = _cache_lookup(model, messages, generation_config, read_cache)
+    if hit is not None:
+        return hit
+    client = get_client(model)
+    limiter = get_limiter(model, config[model])
+    estimated_tokens = estimate_tokens(messages)
+    response = _request(model, limiter, estimated_tokens,
+                        lambda: client.chat.completions.create(**_create_kwargs(model, messages, generation_config)))
+    limiter.on_success(estimated_tokens, _usage_tokens(response))
+    response, metadata = _parse_completion(response)
+    _cache_store(key, response, metadata)
+    return response, metadata
+
+
+async def agenerate(model="gpt-4o", messages=None, generation_config={"max_tokens": 16384, "temperature": 0.0}, read_cache=True):
+    key, hit = _cache_lookup(model, messages, generation_config, read_cache)
+    if hit is not None:
+        return hit
+    client = get_async_client(model)
+    limiter = get_limiter(model, config[model])
+    estimated_tokens = estimate_tokens(messages)
+    response = await _arequest(model, limiter, estimated_tokens,
+                               lambda: client.chat.completions.create(**_create_kwargs(model, messages, generation_config)))
+    limiter.on_success(estimated_tokens, _usage_tokens(response))
+    response, metadata = _parse_completion(response)
+    _cache_store(key, response, metadata)
+    return response, metadata
+
+
+# --stream_stop_early: close a stream once a ```json block is closed, instead of reading it to the end
+STREAM_OPTIONS = {"stop_early": False}
+
+
+def configure_stream(stop_early=False):
+    STREAM_OPTIONS["stop_early"] = stop_early
+
+
+def _stream_kwargs(model, messages, generation_config):
+    return {**_create_kwargs(model, messages, generation_config), "stream": True, "stream_options": {"include_usage": True}}
+
+
+def _feed_chunk(scanner, chunk):
+    """Feed a streamed chunk to the scanner; returns its usage, reported in the last chunk only."""
+    if chunk.choices and chunk.choices[0].delta.content:
+        scanner.feed(chunk.choices[0].delta.content)
+    return chunk.usage
+
+
+def _stop_stream(scanner):
+    """Whether to close the stream now: its json block is malformed, or closed with --stream_stop_early."""
+    return scanner.state == MALFORMED or (STREAM_OPTIONS["stop_early"] and scanner.closed)
+
+
+def _stream_result(messages, scanner, usage, stopped):
+    """Response and metadata of a streamed completion; the token counts are estimated if the provider did not report them."""
+    if usage is not None:
+        metadata = _usage_metadata(usage)
+    else:
+        metadata = {
+            "prompt_token_count": estimate_tokens(messages),
+            "candidates_token_count": len(scanner.text) // 4,
+            "thoughts_token_count": 0,
+            "cached_token_count": 0,
+            "usage_estimated": True,
+        }
+    metadata["stream_state"] = scanner.state
+    metadata["stream_stopped"] = stopped
+    return scanner.text, metadata
+
+
+def generate_stream(model="gpt-4o", messages=None, generation_config={"max_tokens": 16384, "temperature": 0.0}, read_cache=True):
+    """
+    Like generate(), but streams the completion through a JsonStreamScanner, which records the state of
+    its last ```json block in the metadata (stream_state). The stream is closed as soon as a block turns
+    out malformed, so that generate_json requests again without waiting for the rest; such responses are
+    not cached. With --stream_stop_early (see configure_stream) it is also closed once a complete block
+    is followed by its closing fence, taking that block as the final one; otherwise the whole completion
+    is read. stream_stopped in the metadata tells whether the stream was closed before its end.
+    """
+    key, hit = _cache_lookup(model, messages, generation_config, read_cache)
+    if hit is not None:
+        return hit
+    client = get_client(model)
+    limiter = get_limiter(model, config[model])
+    estimated_tokens = estimate_tokens(messages)
+
+    def request():
+        scanner, usage, stopped = JsonStreamScanner(), None, False
+        with client.chat.completions.create(**_stream_kwargs(model, messages, generation_config)) as stream:
+            for chunk in stream:
+                usage = _feed_chunk(scanner, chunk) or usage
+                if _stop_stream(scanner):
+                    stopped = True
+                    break
+        return _stream_result(messages, scanner, usage, stopped)
+
+    response, metadata = _request(model, limiter, estimated_tokens, request)
+    limiter.on_success(estimated_tokens, metadata["prompt_token_count"] + metadata["candidates_token_count"])
+    if metadata["stream_state"] != MALFORMED:
+        _cache_store(key, response, metadata)
+    return response, metadata
+
+
+async def agenerate_stream(model="gpt-4o", messages=None, generation_config={"max_tokens": 16384, "temperature": 0.0}, read_cache=True):
+    key, hit = _cache_lookup(model, messages, generation_config, read_cache)
+    if hit is not None:
+        return hit
+    client = get_async_client(model)
+    limiter = get_limiter(model, config[model])
+    estimated_tokens = estimate_tokens(messages)
+
+    async def request():
+        scanner, usage, stopped = JsonStreamScanner(), None, False
+        async with await client.chat.completions.create(**_stream_kwargs(model, messages, generation_config)) as stream:
+            async for chunk in stream:
+                usage = _feed_chunk(scanner, chunk) or usage
+                if _stop_stream(scanner):
+                    stopped = True
+                    break
+        return _stream_result(messages, scanner, usage, stopped)
+
+    response, metadata = await _arequest(model, limiter, estimated_tokens, request)
+    limiter.on_success(estimated_tokens, metadata["prompt_token_count"] + metadata["candidates_token_count"])
+    if metadata["stream_state"] != MALFORMED:
+        _cache_store(key, response, metadata)
+    return response, metadata
+
+
+# attempts at a response that parses, on top of the request retries of generate()
+PARSE_RETRIES = 5
+
+
+def _attempt_config(generation_config, temperature_step, attempt):
+    # later attempts are sampled at a higher temperature; with a fixed temperature, only the first one may be cached
+    config = dict(generation_config)
+    config["temperature"] = generation_config["temperature"] + temperature_step * attempt
+    return config, attempt == 0 or temperature_step != 0
+
+
+def _parse_attempt(parse, response, metadata, item_id, attempt, max_retries):
+    """(True, parse(response)), or (False, None) with a message if it fails."""
+    try:
+        # a stream closed at a malformed json block is requested again without parsing what was read
+        if metadata.get("stream_state") == MALFORMED:
+            raise ValueError("Malformed json block in the stream")
+        return True, parse(response)
+    except Exception:
+        if attempt < max_retries - 1:
+            print(f"Attempt {attempt+1} failed to parse JSON for item {item_id}, retrying...")
+        else:
+            print(f"Item {item_id} failed to parse JSON after {max_retries} attempts. Returning last response.")
+        return False, None
+
+
+def generate_json(model, messages, generation_config={"max_tokens": 16384, "temperature": 0.0}, parse=extract_and_parse_json,
+                  item_id="unknown", stream=False, temperature_step=0.1, max_retries=PARSE_RETRIES):
+    """
+    Request a completion until parse(response) succeeds, up to max_retries times, raising the temperature
+    by temperature_step per attempt. Returns (response, metadata, parsed) of the last attempt, with
+    parsed None if no attempt parsed.
+    """
+    generate_fn = generate_stream if stream else generate
+    for attempt in range(max_retries):
+        attempt_config, read_cache = _attempt_config(generation_config, temperature_step, attempt)
+        response, metadata = generate_fn(model=model, messages=messages, generation_config=attempt_config, read_cache=read_cache)
+        parsed_ok, parsed = _parse_attempt(parse, response, metadata, item_id, attempt, max_retries)
+        if parsed_ok:
+            break
+    return response, metadata, parsed
+
+
+async def agenerate_json(model, messages, generation_config={"max_tokens": 16384, "temperature": 0.0}, parse=extract_and_parse_json,
+                         item_id="unknown", stream=False, temperature_step=0.1, max_retries=PARSE_RETRIES):
+    """generate_json on the event loop of utils.executor.AsyncExecutor."""
+    generate_fn = agenerate_stream if stream else agenerate
+    for attempt in range(max_retries):
+        attempt_config, read_cache = _attempt_config(generation_config, temperature_step, attempt)
+        response, metadata = await generate_fn(model=model, messages=messages, generation_config=attempt_config, read_cache=read_cache)
+        parsed_ok, parsed = _parse_attempt(parse, response, metadata, item_id, attempt, max_retries)
+        if parsed_ok:
+            break
+    return response, metadata, parsed
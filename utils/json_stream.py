@@ -0,0 +1,105 @@
+FENCE = "```json"
+CLOSING_FENCE = "```"
+
+# scanner states
+SEARCHING, OPENING, OBJECT, COMPLETE, MALFORMED = "searching", "opening", "object", "complete", "malformed"
+
+
+class JsonStreamScanner:
+    """
+    Incremental scanner for the ```json blocks the judges end their output with. Text is fed chunk by
+    chunk as it is streamed; every character is looked at once, tracking the bracket nesting and string
+    escapes, so the state always describes the last block seen so far, which is the one
+    extract_and_parse_json parses: COMPLETE once its object is closed, MALFORMED once it cannot be a
+    valid object any more (the block does not start with an object or array, a bracket is closed by the
+    wrong one, or a ``` fence shows up before the object is closed). Every new ```json fence starts a new
+    block, so a draft or example block before the final one does not decide the state.
+    closed is set once the closing ``` fence of a COMPLETE block follows its object with only whitespace
+    in between, and cleared by the next ```json fence.
+    Whether the object then parses is still decided by extract_and_parse_json.
+    """
+    def __init__(self):
+        self.chunks = []
+        # end of the text that is scanned again with the next chunk (a possibly split fence)
+        self.tail = ""
+        self.state = SEARCHING
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        # the object of the last block is complete and only whitespace followed so far
+        self.closing = False
+        self.closed = False
+
+    @property
+    def text(self):
+        """All text fed so far; the chunks are joined on first access, not on every feed."""
+        if len(self.chunks) > 1:
+            self.chunks = ["".join(self.chunks)]
+        return self.chunks[0] if self.chunks else ""
+
+    def feed(self, chunk):
+        """Append streamed text and scan it; returns the state."""
+        self.chunks.append(chunk)
+        text, position = self.tail + chunk, 0
+        while position < len(text):
+            if self.state == OPENING:
+                char = text[position]
+                if char in "{[":
+                    self.state = OBJECT
+                elif not char.isspace():
+                    self.state = MALFORMED
+                else:
+                    position += 1
+            elif self.state == OBJECT:
+                position = self._scan_object(text, position)
+            elif self.closing:
+                rest = text[position:].lstrip()
+                position = len(text) - len(rest)
+                if len(rest) <= len(CLOSING_FENCE) and CLOSING_FENCE.startswith(rest):
+                    # wait for the character after the fence: "```json" opens the next block instead
+                    break
+                self.closing = False
+                if rest.startswith(CLOSING_FENCE) and not rest[len(CLOSING_FENCE)].isalnum():
+                    self.closed = True
+                    position += len(CLOSING_FENCE)
+            else:
+                start = text.find(FENCE, position)
+                if start < 0:
+                    # keep a possibly split fence at the end for the next chunk
+                    position = max(position, len(text) - len(FENCE) + 1)
+                    break
+                self.state, position = OPENING, start + len(FENCE)
+                self.stack, self.in_string, self.escape = [], False, False
+                self.closed = False
+        self.tail = text[position:]
+        return self.state
+
+    def _scan_object(self, text, position):
+        stack = self.stack
+        for i in range(position, len(text)):
+            char = text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                stack.append("}")
+            elif char == "[":
+                stack.append("]")
+            elif char in "}]":
+                if not stack or stack.pop() != char:
+                    self.state = MALFORMED
+                    return i + 1
+                if not stack:
+                    self.state, self.closing = COMPLETE, True
+                    return i + 1
+            elif char == "`":
+                # the fence may open the next block
+                self.state = MALFORMED
+                return i
+        return len(text)
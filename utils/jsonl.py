@@ -0,0 +1,66 @@
+import os
+import json
+
+
+class JsonlWriter:
+    """
+    Append-only JSONL writer that flushes every record and fsyncs every `fsync_every` records,
+    so results survive a crash of the run. With append=True, a trailing partial line left
+    by a previous crash is dropped before writing.
+    """
+    def __init__(self, path, append=False, fsync_every=50):
+        if append and os.path.exists(path):
+            _truncate_partial_line(path)
+        self.f = open(path, "a" if append else "w")
+        self.fsync_every = fsync_every
+        self.count = 0
+
+    def write(self, record):
+        self.f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.f.flush()
+        self.count += 1
+        if self.count % self.fsync_every == 0:
+            os.fsync(self.f.fileno())
+
+    def close(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def _truncate_partial_line(path):
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+def load_finished_keys(path, key_fields):
+    """Return the set of key tuples of records in `path` that have a model response."""
+    finished = set()
+    if not os.path.exists(path):
+        return finished
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("model_response") is None:
+                continue
+            finished.add(tuple(record[field] for field in key_fields))
+    return finished
+
+
+def unfinished_questions(question_ids, finished, key_fields):
+    """question_ids, in order, with a side (or, for keys without "model", the question) not in finished."""
+    if "model" not in key_fields:
+        return [question_id for question_id in question_ids if (question_id,) not in finished]
+    return [question_id for question_id in question_ids if not {(question_id, "a"), (question_id, "b")} <= finished]
@@ -0,0 +1,133 @@
+import time
+import random
+import threading
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, InternalServerError, APIConnectionError)
+DEFAULT_MAX_RETRIES = 6
+# allow a burst of this many seconds worth of quota
+BURST_SECONDS = 10
+# the effective rate never drops below this fraction of the configured quota
+MIN_SCALE = 0.1
+
+
+class TokenBucket:
+    """
+    Reservation-based token bucket. `reserve` never blocks: it takes the amount from the bucket
+    (possibly going into debt) and returns how long the caller has to wait before its request is
+    within the rate, so it works the same from threads (time.sleep) and coroutines (asyncio.sleep).
+    """
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        with self.lock:
+            self._refill()
+            self.available -= amount
+            if self.available >= 0:
+                return 0.0
+            return -self.available / self.rate
+
+    def adjust(self, amount):
+        """Give back (negative) or take (positive) the difference between the estimate and the actual usage."""
+        with self.lock:
+            self._refill()
+            self.available -= amount
+
+    def set_rate(self, rate_per_minute):
+        with self.lock:
+            self._refill()
+            self.rate = rate_per_minute / 60.0
+            self.capacity = max(1.0, self.rate * BURST_SECONDS)
+
+
+class ModelLimiter:
+    """
+    Requests/min and tokens/min limits for one config entry. The effective rate is halved on every
+    429 and recovers additively on success, so a quota set slightly too high converges instead of
+    producing a stream of rate-limit errors.
+    """
+    def __init__(self, rpm=None, tpm=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.scale = 1.0
+        self.lock = threading.Lock()
+        self.request_bucket = TokenBucket(rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm) if tpm else None
+
+    def acquire(self, estimated_tokens):
+        """Reserve one request and `estimated_tokens` tokens; returns the delay in seconds before sending."""
+        delay = 0.0
+        if self.request_bucket is not None:
+            delay = max(delay, self.request_bucket.reserve(1))
+        if self.token_bucket is not None:
+            delay = max(delay, self.token_bucket.reserve(estimated_tokens))
+        return delay
+
+    def on_success(self, estimated_tokens, actual_tokens):
+        if self.token_bucket is not None:
+            self.token_bucket.adjust(actual_tokens - estimated_tokens)
+        if self.scale < 1.0:
+            self._set_scale(min(1.0, self.scale + 0.05))
+
+    def on_rate_limit(self):
+        self._set_scale(max(MIN_SCALE, self.scale / 2))
+
+    def _set_scale(self, scale):
+        with self.lock:
+            self.scale = scale
+            if self.request_bucket is not None:
+                self.request_bucket.set_rate(self.rpm * scale)
+            if self.token_bucket is not None:
+                self.token_bucket.set_rate(self.tpm * scale)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(model, model_config):
+    """Return the shared limiter for a config entry, using its optional "rpm" and "tpm" fields."""
+    with _limiters_lock:
+        if model not in _limiters:
+            _limiters[model] = ModelLimiter(rpm=model_config.get("rpm"), tpm=model_config.get("tpm"))
+        return _limiters[model]
+
+
+def estimate_tokens(messages):
+    """Rough prompt size: ~4 characters per token, plus a flat cost per image."""
+    chars = 0
+    images = 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content:
+            if part["type"] == "text":
+                chars += len(part["text"])
+            else:
+                images += 1
+    return chars // 4 + images * 1000
+
+
+def retry_delay(error, attempt, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter, honouring the provider's Retry-After header when present."""
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        try:
+            return min(cap, float(retry_after)) + random.uniform(0, base)
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(cap, base * 2 ** attempt))
@@ -0,0 +1,159 @@
+import os
+import json
+from utils.dataset import iter_spans, index_path, RecordStore
+
+
+BRANCHES = ["intention", "static", "dynamic"]
+# bumped whenever the fields of an index entry change, so that an older index is rebuilt
+INDEX_VERSION = 3
+
+
+def count_leaves(tree_item):
+    """Number of nodes whose "children" is null, anywhere below tree_item."""
+    if isinstance(tree_item, list):
+        return sum(count_leaves(child) for child in tree_item)
+    if not isinstance(tree_item, dict):
+        return 0
+    count = 1 if "children" in tree_item and tree_item["children"] is None else 0
+    return count + sum(count_leaves(value) for value in tree_item.values())
+
+
+def compute_height(tree_item):
+    if not isinstance(tree_item, dict) or "children" not in tree_item or tree_item["children"] is None:
+        return 1
+    children = tree_item["children"]
+    if not children:
+        return 1
+    return 1 + max(compute_height(child) for child in children)
+
+
+# value codes of the flat tree form
+VALUE_NONE, VALUE_A, VALUE_B, VALUE_TRUE, VALUE_FALSE, VALUE_OTHER = range(6)
+
+
+def value_code(value):
+    if value is None:
+        return VALUE_NONE
+    if value is True:
+        return VALUE_TRUE
+    if value is False:
+        return VALUE_FALSE
+    if value == "A" and isinstance(value, str):
+        return VALUE_A
+    if value == "B" and isinstance(value, str):
+        return VALUE_B
+    return VALUE_OTHER
+
+
+def flatten_tree(tree, descriptions=False):
+    """
+    Flat pre-order form of a rubric tree or of a judged tree: parallel lists of node ids ("" for the
+    root, then "1", "1.1", ... following the numbering of the GUI prompts), parent positions (-1 for the
+    root), depths, leaf flags (children is null) and value codes, plus the node descriptions if
+    descriptions is set. Only dict nodes reached through "children" are kept, like the recursive walks
+    this replaces.
+    """
+    flat = {"ids": [], "parent": [], "depth": [], "leaf": [], "value": []}
+    if descriptions:
+        flat["description"] = []
+    stack = [(tree, "", -1, 0)]
+    while stack:
+        node, node_id, parent, depth = stack.pop()
+        if not isinstance(node, dict):
+            continue
+        position = len(flat["ids"])
+        children = node.get("children")
+        flat["ids"].append(node_id)
+        flat["parent"].append(parent)
+        flat["depth"].append(depth)
+        flat["leaf"].append(children is None)
+        flat["value"].append(value_code(node.get("value")))
+        if descriptions:
+            flat["description"].append(node.get("description"))
+        if children is not None:
+            children = list(children)
+            for i in range(len(children) - 1, -1, -1):
+                child_id = f"{node_id}.{i + 1}" if node_id else str(i + 1)
+                stack.append((children[i], child_id, position, depth + 1))
+    return flat
+
+
+def index_branch(branch):
+    """
+    Index entry of one rubric branch: leaf count, height, the nodes below the branch as
+    [node id, depth, has children, description] in pre-order, and the leaves that have a description
+    as [node id, description] pairs, the branch itself included if it is a leaf.
+    """
+    flat = flatten_tree(branch, descriptions=True)
+    has_children = [False] * len(flat["ids"])
+    for parent in flat["parent"]:
+        if parent >= 0:
+            has_children[parent] = True
+    nodes = [[flat["ids"][i], flat["depth"][i], has_children[i], flat["description"][i]] for i in range(1, len(flat["ids"]))]
+    leaf_list = [[flat["ids"][i], flat["description"][i]] for i in range(len(flat["ids"]))
+                 if flat["leaf"][i] and flat["description"][i] is not None]
+    return {
+        "leaves": count_leaves(branch),
+        "height": compute_height(branch),
+        "nodes": nodes,
+        "leaf_list": leaf_list,
+    }
+
+
+def index_rubric(rubric_tree):
+    entry = {"leaves": count_leaves(rubric_tree), "branches": {}}
+    for key in BRANCHES:
+        # a missing branch is left out, so that looking it up fails like it does on the tree itself
+        if key not in rubric_tree:
+            continue
+        entry["branches"][key] = index_branch(rubric_tree[key])
+    entry["height"] = 1 + max([branch["height"] for branch in entry["branches"].values()], default=0)
+    return entry
+
+
+def build_rubric_index(path):
+    """
+    Write `<name>.index.json` next to data/rubric.jsonl: per question, the leaf count and height of the
+    whole rubric and, per branch, its leaf count, height, nodes and leaf list (see index_branch), plus
+    the [byte offset, length] span of the question's line for load_rubrics. Stamped with the size and
+    mtime of the rubric file so that a stale index is detected and rebuilt.
+    """
+    questions = {}
+    for span, record in iter_spans(path):
+        questions[record["question_id"]] = {**index_rubric(record["rubric_tree"]), "span": span}
+    stat = os.stat(path)
+    with open(index_path(path), "w") as f:
+        json.dump({"version": INDEX_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "questions": questions}, f)
+    return questions
+
+
+def load_rubric_index(path):
+    """question_id -> rubric index entry (see build_rubric_index), (re)building the index if needed."""
+    if os.path.exists(index_path(path)):
+        with open(index_path(path), "r") as f:
+            index = json.load(f)
+        stat = os.stat(path)
+        if index.get("version") == INDEX_VERSION and index["size"] == stat.st_size and index["mtime_ns"] == stat.st_mtime_ns:
+            return index["questions"]
+    return build_rubric_index(path)
+
+
+def load_rubrics(path, rubric_index=None):
+    """
+    question_id -> rubric tree from data/rubric.jsonl, each tree parsed only when it is looked up (through
+    the spans of the rubric index), without keeping the raw model responses.
+    """
+    if rubric_index is None:
+        rubric_index = load_rubric_index(path)
+    return RecordStore(path, {question_id: entry["span"] for question_id, entry in rubric_index.items()}, field="rubric_tree")
+
+
+def leaf_counts(entry):
+    """branch -> number of leaves, from an index entry."""
+    return {key: entry["branches"][key]["leaves"] for key in BRANCHES}
+
+
+def leaf_descriptions(branch, prefix=""):
+    """Descriptions of the leaves of an indexed branch, only those below node `prefix` if given."""
+    return [description for node_id, description in branch["leaf_list"]
+            if not prefix or node_id == prefix or node_id.startswith(prefix + ".")]
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import sqlite3
+
+
+DEFAULT_QUEUE_PATH = "parallel_logs/queue.sqlite"
+# steps assumed for a task whose metadata.json cannot be read
+DEFAULT_MAX_STEPS = 15
+# final results of a GUI task that a rerun keeps; any other one (SERVER ERROR, INITIAL_ERROR, ERROR ITERATION,
+# NONE RESPONSE, ...) or a missing messages.json means the task is run again
+TERMINAL_RESULTS = {"DONE", "FAILED", "MAX ROUNDS", "PARSING RESPONSE ERROR", "UNRECOGNIZED ACTION TYPE"}
+
+
+def read_webs(path, start_line=1, end_line=None):
+    """(line number, web directory) of the lines start_line..end_line (1-indexed, inclusive) of webs.txt."""
+    with open(path, "r") as f:
+        lines = [line.strip() for line in f]
+    end_line = len(lines) if end_line is None else min(end_line, len(lines))
+    return [(i, lines[i - 1]) for i in range(start_line, end_line + 1)]
+
+
+def task_finished(task_dir):
+    """Whether the task's messages.json records a terminal final_result."""
+    try:
+        with open(os.path.join(task_dir, "messages.json"), "r") as f:
+            return json.load(f).get("final_result") in TERMINAL_RESULTS
+    except (OSError, ValueError, AttributeError):
+        return False
+
+
+def pending_tasks(tasks_file_path, rerun_all=False):
+    """The task directories of a tasks.txt that still have to run (all of them with rerun_all)."""
+    with open(tasks_file_path, "r") as f:
+        task_dirs = [line.strip() for line in f]
+    return [task_dir for task_dir in task_dirs if task_dir and (rerun_all or not task_finished(task_dir))]
+
+
+def estimate_cost(web_dir, rerun_all=False):
+    """Expected work of a web page: the summed max_steps of the tasks in its tasks.txt that still have to run."""
+    tasks_file_path = os.path.join(web_dir, "tasks.txt")
+    if not os.path.isfile(tasks_file_path):
+        return 0
+    cost = 0
+    for task_dir in pending_tasks(tasks_file_path, rerun_all):
+        try:
+            with open(os.path.join(task_dir, "metadata.json"), "r") as f:
+                cost += json.load(f)["max_steps"]
+        except (OSError, KeyError, ValueError):
+            cost += DEFAULT_MAX_STEPS
+    return cost
+
+
+class TaskQueue:
+    """
+    Work queue of web pages shared by the GUI workers of one run through a SQLite file. Workers claim
+    one page at a time, the most expensive pending one first, so long pages start early and the
+    workers finish at about the same time instead of one fixed chunk running hours longer.
+    Claims run in BEGIN IMMEDIATE transactions, so two workers never get the same page.
+    """
+    def __init__(self, path=DEFAULT_QUEUE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS webs ("
+            "line INTEGER PRIMARY KEY, web_dir TEXT, cost REAL, status TEXT, worker TEXT, claimed_at REAL, finished_at REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS webs_pending ON webs (status, cost)")
+
+    def populate(self, webs, rerun_all=False):
+        """
+        Add (line, web_dir) pages that are not in the queue yet; every worker may call this, the first
+        one fills the queue. Costs are estimated outside of the transaction.
+        """
+        known = {line for (line,) in self.conn.execute("SELECT line FROM webs")}
+        rows = [(line, web_dir, estimate_cost(web_dir, rerun_all), "pending") for line, web_dir in webs if web_dir and line not in known]
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany("INSERT OR IGNORE INTO webs (line, web_dir, cost, status) VALUES (?, ?, ?, ?)", rows)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def claim(self, worker):
+        """The (line, web_dir) of the most expensive pending page, marked as running; None when the queue is empty."""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                "SELECT line, web_dir FROM webs WHERE status = 'pending' ORDER BY cost DESC, line ASC LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                self.conn.execute(
+                    "UPDATE webs SET status = 'running', worker = ?, claimed_at = ? WHERE line = ?",
+                    (str(worker), time.time(), row[0])
+                )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return None if row is None else (row[0], row[1])
+
+    def finish(self, line):
+        self.conn.execute("UPDATE webs SET status = 'done', finished_at = ? WHERE line = ?", (time.time(), line))
+
+    def counts(self):
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM webs GROUP BY status").fetchall())
+
+    def close(self):
+        self.conn.close()
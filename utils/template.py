@@ -0,0 +1,93 @@
+import string
+
+
+class CompiledTemplate:
+    """
+    A str.format template parsed once into literal and field segments. Fields known ahead of time can
+    be bound with `partial` and literal text appended with `+`, so `render` only joins the precomputed
+    segments with the per-item values and produces the same string as template.format(**kwargs).
+    Only plain named fields ("{name}") are supported.
+    """
+    def __init__(self, template="", segments=None):
+        if segments is None:
+            segments = []
+            for literal, field, format_spec, conversion in string.Formatter().parse(template):
+                if literal:
+                    segments.append((True, literal))
+                if field is not None:
+                    if not field.isidentifier() or format_spec or conversion:
+                        raise ValueError(f"Unsupported template field: {{{field}}}")
+                    segments.append((False, field))
+        self.segments = self._merge(segments)
+        self.fields = {value for is_literal, value in self.segments if not is_literal}
+
+    @staticmethod
+    def _merge(segments):
+        merged = []
+        for is_literal, value in segments:
+            if is_literal and merged and merged[-1][0]:
+                merged[-1] = (True, merged[-1][1] + value)
+            elif not is_literal or value:
+                merged.append((is_literal, value))
+        return merged
+
+    def partial(self, **kwargs):
+        """A new template with the given fields replaced by their (formatted) values."""
+        return CompiledTemplate(segments=[
+            (True, format(kwargs[value])) if not is_literal and value in kwargs else (is_literal, value)
+            for is_literal, value in self.segments
+        ])
+
+    def __add__(self, text):
+        """A new template with literal text appended."""
+        return CompiledTemplate(segments=self.segments + [(True, text)])
+
+    def render(self, **kwargs):
+        return "".join(value if is_literal else format(kwargs[value]) for is_literal, value in self.segments)
+
+    def split(self):
+        """(leading literal text, template from the first field to the last one, trailing literal text)."""
+        segments = self.segments
+        head = segments[0][1] if segments and segments[0][0] else ""
+        tail = segments[-1][1] if len(segments) > 1 and segments[-1][0] else ""
+        body = segments[(1 if head else 0):(len(segments) - 1 if tail else len(segments))]
+        if not self.fields:
+            return head, CompiledTemplate(), ""
+        return head, CompiledTemplate(segments=body), tail
+
+
+# references to the per-item sections in the output text that is moved in front of them
+MOVED_REFERENCES = {"provided above": "provided below"}
+
+
+def _moved(text):
+    for old, new in MOVED_REFERENCES.items():
+        text = text.replace(old, new)
+    return text
+
+
+def split_instructions(prompt, output):
+    """
+    Split a prompt template and its output template into the instructions that are the same for every
+    item (the prompt text before the section holding the first field, and the output text after the
+    section holding the last field) and the per-item prompt and output templates, so that the
+    instructions can be sent as a byte-identical prefix that provider-side prompt caches can reuse.
+    Sections are markdown "## " headings; `output` may also be literal text without fields. The output
+    text moved into the instructions now comes before the per-item sections, so references to them are
+    reworded to match (see MOVED_REFERENCES).
+    """
+    head, body, tail = prompt.split()
+    cut = head.rfind("\n## ") + 1
+    instructions = head[:cut]
+    prompt_body = CompiledTemplate(segments=[(True, head[cut:])] + body.segments + [(True, tail)])
+    if isinstance(output, str):
+        return instructions + output, prompt_body, CompiledTemplate()
+    head, body, tail = output.split()
+    cut = tail.find("\n## ") + 1 if "\n## " in tail else len(tail)
+    output_body = CompiledTemplate(segments=[(True, head)] + body.segments + [(True, tail[:cut])])
+    return instructions + _moved(tail[cut:]), prompt_body, output_body
+
+
+def prefix_cache_messages(instructions, content):
+    """Messages with the fixed instructions as a leading system message and the per-item content after it."""
+    return [{"role": "system", "content": instructions}, {"role": "user", "content": content}]
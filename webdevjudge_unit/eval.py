@@ -6,8 +6,10 @@ from tqdm import tqdm
 import concurrent.futures
 
 sys.path.append("./")
-from utils.get_response import generate
-from utils.basic import extract_and_parse_json
+from utils.get_response import generate_json, agenerate_json, add_usage
+from utils.executor import AsyncExecutor
+from utils import cache
+from evaluator.scoring import load_table
 
 LLM_JUDGE_PROMPT = """You are an expert web developer. Your task is to determine if a given web development task is feasible based on the provided HTML code.
 
@@ -47,6 +49,10 @@ def parse_args():
     parser.add_argument("--base_dir", type=str, default="/data/WebDevJudgeUnit_test")
     parser.add_argument("--agent", action="store_true")
     parser.add_argument("--path_list", type=str, default="web_unit.txt")
+    parser.add_argument("--use_async", action="store_true")
+    parser.add_argument("--max_concurrency", type=int, default=512)
+    parser.add_argument("--no_cache", action="store_true")
+    parser.add_argument("--cache_path", type=str, default="cache/responses.sqlite")
     return parser.parse_args()
 
 def construct_prompt(html_code, task_instruction, expected_result):
@@ -54,43 +60,43 @@ def construct_prompt(html_code, task_instruction, expected_result):
     return [{"role": "user", "content": prompt_text}]
 
 
+def feasible_judgment(parsed_response):
+    """Normalized judgment stored with each result: whether the judge found the task feasible."""
+    return bool(parsed_response.get("feasible")) if isinstance(parsed_response, dict) else False
+
+
+def load_feasible(result_path):
+    """key -> 1/0 judged feasibility, from the stored "feasible" field (model_response for older outputs)."""
+    res = {}
+    with open(result_path, "r") as f:
+        for line in f:
+            result = json.loads(line)
+            feasible = result["feasible"] if "feasible" in result else result["model_response"]["feasible"]
+            res[f"{result['web_id']}_{result['task_id']}"] = 1 if feasible else 0
+    return res
+
+
+def judge_result(item, response, metadata_response, parsed_response):
+    if parsed_response is None:
+        parsed_response = {"feasible": False, "reasoning": "Failed to parse model output."}
+    return {
+        "web_id": item["web_id"],
+        "task_id": item['task_id'],
+        "model_response": parsed_response,
+        "feasible": feasible_judgment(parsed_response),
+        "raw_response": response,
+        "metadata": metadata_response
+    }
+
+
 def process_item(item, model):
-    html_code = item["code"]
-    task_instruction = item['task']
-    expected_result = item['expected']
-    web_id = item["web_id"]
-    task_id = item['task_id']
-
-    prompt = construct_prompt(html_code, task_instruction, expected_result)
-    
-    generate_config = {"max_output_tokens": 8192, "temperature": 0.0}
-    response = None
-    metadata_response = None
-    max_retries = 5
-    for i in range(max_retries):
-        generate_config["temperature"] = 0.0 + 0.1 * i
-        response, metadata_response = generate(model=model, messages=prompt, generation_config=generate_config)
-        try:
-            parsed_response = extract_and_parse_json(response)
-            return {
-                "web_id": web_id,
-                "task_id": task_id,
-                "model_response": parsed_response,
-                "raw_response": response,
-                "metadata": metadata_response
-            }
-        except Exception as e:
-            if i < max_retries - 1:
-                print(f"Attempt {i+1} failed to parse JSON for item {web_id}, retrying...")
-            else:
-                print(f"Item {web_id} failed to parse JSON after {max_retries} attempts.")
-                return {
-                    "web_id": web_id,
-                    "task_id": task_id,
-                    "model_response": {"feasible": False, "reasoning": "Failed to parse model output."},
-                    "raw_response": response,
-                    "metadata": metadata_response
-                }
+    prompt = construct_prompt(item["code"], item['task'], item['expected'])
+    return judge_result(item, *generate_json(model, prompt, {"max_tokens": 8192, "temperature": 0.0}, item_id=item["web_id"]))
+
+
+async def aprocess_item(item, model):
+    prompt = construct_prompt(item["code"], item['task'], item['expected'])
+    return judge_result(item, *await agenerate_json(model, prompt, {"max_tokens": 8192, "temperature": 0.0}, item_id=item["web_id"]))
 
 def generate_judge(args):
     with open(args.data_path, "r") as f:
@@ -100,18 +106,18 @@ def generate_judge(args):
     os.makedirs(args.output_dir, exist_ok=True)
 
     results = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=128) as executor:
-        future_to_item = {executor.submit(process_item, item, args.model): item for item in items}
+    if args.use_async:
+        executor, process_fn = AsyncExecutor(max_concurrency=args.max_concurrency), aprocess_item
+    else:
+        executor, process_fn = concurrent.futures.ThreadPoolExecutor(max_workers=128), process_item
+    with executor:
+        future_to_item = {executor.submit(process_fn, item, args.model): item for item in items}
         for future in tqdm(concurrent.futures.as_completed(future_to_item), total=len(future_to_item)):
             try:
                 result = future.result()
                 if result:
                     results.append(result)
-                    
-                    metadata = result["metadata"]
-                    total_tokens["prompt_token_count"] += metadata["prompt_token_count"]
-                    total_tokens["candidates_token_count"] += metadata["candidates_token_count"]
-                    total_tokens["thoughts_token_count"] += metadata.get("thoughts_token_count", 0)
+                    add_usage(total_tokens, result["metadata"])
             except Exception as e:
                 print(f"Error processing item: {e}")
 
@@ -126,13 +132,10 @@ def evaluate_llm(args):
         items = [json.loads(line) for line in f]
     labels = {f"{item['web_id']}_{item['task_id']}": item["label"] for item in items}
 
-    with open(os.path.join(args.output_dir, f"{args.model}_judge.jsonl"), "r") as f:
-        results = [json.loads(line) for line in f]
+    # cached next to the results as <name>.parsed.pkl, so re-evaluating does not re-read the raw responses
+    result_path = os.path.join(args.output_dir, f"{args.model}_judge.jsonl")
+    res = load_table(result_path, lambda: load_feasible(result_path))
 
-    res = {}
-    for result in results:
-        res[f"{result['web_id']}_{result['task_id']}"] = 1 if result["model_response"]["feasible"] else 0
-    
     TP = 0
     FP = 0
     TN = 0
@@ -197,6 +200,7 @@ def evaluate_agent(args):
 
 if __name__ == "__main__":
     args = parse_args()
+    cache.configure(path=args.cache_path, enabled=not args.no_cache)
     print("Model: ", args.model)
     print("Output Dir: ", args.output_dir)
     if not args.agent: